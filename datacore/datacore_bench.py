@@ -0,0 +1,239 @@
+#coding:utf-8
+"""
+Benchmarks for datacore_get_perf.py
+"""
+from __future__ import print_function, unicode_literals
+import argparse
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+import datacore_get_perf as dcs
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+BENCH_CONFIG = """
+[SERVERS]
+rest_server = 127.0.0.1:{port}
+datacore_server = bench
+influxdb_server = 127.0.0.1
+influxdb_port = {port}
+
+[CREDENTIALS]
+user = bench
+passwd = bench
+
+[LOGGING]
+log = no
+
+[RESOURCES]
+servers = yes
+pools = yes
+virtualdisks = yes
+physicaldisks = yes
+ports = yes
+hosts = yes
+
+[COLLECTOR]
+max_inflight = {max_inflight}
+"""
+
+
+def synthetic_objects(hosts, virtualdisks, servers=2):
+    """
+    Build DataCore Objects with perf attached, as returned by dcs_get_perf
+    """
+    perf = {"CollectionTime": "/Date(1584031831349)/"}
+    for i in range(60):
+        perf["Counter{}".format(i)] = i * 1000
+
+    dcs_servers = [{"Id": "server-{}".format(i),
+                    "Caption": "SDS{}".format(i),
+                    "ExtendedCaption": "SDS{}".format(i),
+                    "OsVersion": "Windows Server 2016",
+                    "ProductBuild": "15.0.1000.0",
+                    "ProductVersion": "10.0",
+                    "ProductName": "DataCore SANsymphony",
+                    "ProductType": "Full",
+                    "State": 2,
+                    "CacheState": 2,
+                    "PowerState": 2,
+                    "dcs_resource": "servers"} for i in range(servers)]
+    dcs_hosts = [{"Id": "host-{}".format(i),
+                  "Caption": "esx{}".format(i),
+                  "ExtendedCaption": "esx{}".format(i),
+                  "MpioCapable": True,
+                  "AluaSupport": True,
+                  "State": 2,
+                  "dcs_resource": "hosts"} for i in range(hosts)]
+    dcs_virtualdisks = [{"Id": "vd-{}".format(i),
+                         "Caption": "Virtual disk {}".format(i),
+                         "ExtendedCaption": "Virtual disk {}".format(i),
+                         "StorageProfileId": "profile",
+                         "ScsiDeviceIdString": "60030D9000000000000000000000{:04d}".format(i % 10000),
+                         "Type": 0,
+                         "FirstHostId": dcs_servers[0]["Id"],
+                         "SecondHostId": dcs_servers[-1]["Id"],
+                         "DiskStatus": 0,
+                         "Size": {"Value": 1099511627776},
+                         "dcs_resource": "virtualdisks"} for i in range(virtualdisks)]
+    # One port per host, served by the hosts index
+    dcs_ports = [{"Id": "port-{}".format(i),
+                  "Caption": "Port {}".format(i),
+                  "ExtendedCaption": "Port {}".format(i),
+                  "HostId": host["Id"],
+                  "PortType": 2,
+                  "dcs_resource": "ports"} for i, host in enumerate(dcs_hosts)]
+
+    objects = dcs_servers + dcs_hosts + dcs_virtualdisks + dcs_ports
+    for item in objects:
+        item["Performances"] = perf
+    return dcs_servers, dcs_hosts, objects
+
+
+def bench_encode(hosts_counts, virtualdisks, repeat):
+    """
+    Time dcs_to_lines for a growing number of hosts
+    """
+    print("{:>8} {:>10} {:>10} {:>12}".format("hosts", "objects", "encode s", "us/object"))
+    for hosts in hosts_counts:
+        dcs_servers, dcs_hosts, objects = synthetic_objects(hosts, virtualdisks)
+        target = dcs.DcsTarget("bench", "127.0.0.1", "bench", "bench", "bench")
+        target.servers = dict((item["Id"], item) for item in dcs_servers)
+        target.servers_hosts = dict((item["Id"], item) for item in dcs_servers + dcs_hosts)
+
+        best = None
+        for _ in range(repeat):
+            start = time.time()
+            dcs.dcs_to_lines(objects, target)
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print("{:>8} {:>10} {:>10.3f} {:>12.1f}".format(hosts, len(objects), best,
+                                                        best / len(objects) * 1e6))
+
+
+def bench_cycles(port, cycles, max_inflight):
+    """
+    Run full collection cycles against a fake server, return the results
+
+    Runs in its own process (see bench_objects) so peak RSS is the one
+    of the collector alone.
+    """
+    fd, config_file = tempfile.mkstemp(suffix=".ini")
+    with os.fdopen(fd, "w") as f:
+        f.write(BENCH_CONFIG.format(port=port, max_inflight=max_inflight))
+    try:
+        dcs.load_config(config_file)
+    finally:
+        os.remove(config_file)
+    # Injected errors are counted by the fake server, not logged
+    logging.getLogger().setLevel(logging.ERROR)
+
+    stats_url = "http://127.0.0.1:{}/stats".format(port)
+    target = dcs.dcs_targets()[0].open(rates=True)
+    writer = dcs.influx_writer()
+    results = []
+    try:
+        for cycle in range(cycles):
+            before = requests.get(stats_url).json()
+            start = time.time()
+            stats = dcs.dcs_collect(target, writer)
+            elapsed = time.time() - start
+            after = requests.get(stats_url).json()
+            results.append(dict((key, after[key] - before[key]) for key in after if key != "objects"))
+            results[-1]["seconds"] = elapsed
+            results[-1]["inflight_limit"] = stats.fields["inflight_limit"]
+    finally:
+        target.close()
+        writer.close()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return {"objects": after["objects"],
+            "cycles": results,
+            "cpu_seconds": usage.ru_utime + usage.ru_stime,
+            "max_rss_kb": usage.ru_maxrss}
+
+
+def bench_objects(counts, cycles, latency, error_rate, max_inflight, port, capacity=0):
+    """
+    Time full cycles for a growing number of objects
+
+    For each count a fake server and a collector are started in their
+    own processes. The first cycle lists the inventory, the others are
+    the steady state and are reported by their median.
+    """
+    print("{:>8} {:>9} {:>9} {:>8} {:>9} {:>8} {:>10} {:>11} {:>9}".format(
+        "objects", "first s", "cycle s", "rss MB", "req/s", "errors", "points", "bytes sent", "inflight"))
+    reports = []
+    for count in counts:
+        server = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, "datacore_fake_rest.py"),
+                                   "--port", str(port), "--count", str(count),
+                                   "--latency", str(latency), "--error-rate", str(error_rate),
+                                   "--capacity", str(capacity)],
+                                  stdout=subprocess.PIPE)
+        try:
+            server.stdout.readline()
+            output = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+                                              "--run-cycles", str(cycles), "--port", str(port),
+                                              "--max-inflight", str(max_inflight)])
+        finally:
+            server.terminate()
+            server.wait()
+        report = json.loads(output.decode("utf-8").splitlines()[-1])
+        reports.append(report)
+
+        first = report["cycles"][0]
+        steady = sorted(report["cycles"][1:] or report["cycles"], key=lambda c: c["seconds"])
+        median = steady[len(steady) // 2]
+        print("{:>8} {:>9.2f} {:>9.2f} {:>8.1f} {:>9.0f} {:>8} {:>10} {:>11} {:>9}".format(
+            report["objects"], first["seconds"], median["seconds"], report["max_rss_kb"] / 1024.0,
+            median["requests"] / median["seconds"], median["errors"], median["points"],
+            median["write_bytes"], median["inflight_limit"]))
+    return reports
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark the DataCore collector")
+    parser.add_argument("--hosts", default="10,100,1000,5000",
+                        help="comma separated host counts (default: %(default)s)")
+    parser.add_argument("--virtualdisks", type=int, default=1000,
+                        help="virtual disks per run (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="runs per point, best is kept (default: %(default)s)")
+    parser.add_argument("--cycle", action="store_true",
+                        help="run full collection cycles against datacore_fake_rest.py")
+    parser.add_argument("--objects", default="1000,10000,50000",
+                        help="comma separated object counts for --cycle (default: %(default)s)")
+    parser.add_argument("--cycles", type=int, default=3,
+                        help="collection cycles per count for --cycle (default: %(default)s)")
+    parser.add_argument("--latency", type=float, default=0,
+                        help="seconds added to each REST response (default: %(default)s)")
+    parser.add_argument("--error-rate", type=float, default=0,
+                        help="fraction of perf requests failing (default: %(default)s)")
+    parser.add_argument("--max-inflight", type=int, default=16,
+                        help="collector REST requests in flight (default: %(default)s)")
+    parser.add_argument("--capacity", type=int, default=0,
+                        help="fake server REST requests served at once, 0 for no limit (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=18080,
+                        help="fake server port (default: %(default)s)")
+    parser.add_argument("--json", help="also write --cycle results to this file")
+    parser.add_argument("--run-cycles", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_cycles:
+        print(json.dumps(bench_cycles(args.port, args.run_cycles, args.max_inflight)))
+    elif args.cycle:
+        reports = bench_objects([int(c) for c in args.objects.split(",")], args.cycles,
+                                args.latency, args.error_rate, args.max_inflight, args.port, args.capacity)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(reports, f, indent=2)
+    else:
+        bench_encode([int(h) for h in args.hosts.split(",")], args.virtualdisks, args.repeat)
@@ -0,0 +1,248 @@
+#coding:utf-8
+"""
+Fake DataCore REST server and InfluxDB endpoint for benchmarks
+
+Serves /RestService/rest.svc/1.0/{servers,hosts,pools,virtualdisks,
+physicaldisks,ports} and /performance/{id} with synthetic objects, and
+accepts InfluxDB /write and /ping. /stats returns the request counters.
+With a capacity, REST requests above it wait for a free slot, as on an
+overloaded REST server.
+"""
+from __future__ import print_function, unicode_literals, division
+import argparse
+import gzip
+import io
+import json
+import random
+import threading
+import time
+import zlib
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+REST_PREFIX = "/RestService/rest.svc/1.0/"
+
+# Cumulative counters and gauges of a perf payload
+PERF_COUNTERS = ["TotalReads", "TotalWrites", "TotalOperations", "TotalBytesRead",
+                 "TotalBytesWritten", "TotalBytesTransferred", "TotalReadTime",
+                 "TotalWriteTime", "TotalReadsTime", "TotalWritesTime",
+                 "TargetReads", "TargetWrites", "TargetReadTime", "TargetWriteTime",
+                 "InitiatorReads", "InitiatorWrites", "FrontEndTargetOperations",
+                 "FrontEndTargetBytesTransfered", "BackEndTargetOperations",
+                 "CacheReadHits", "CacheReadMisses", "CacheWriteHits", "CacheWriteMisses"]
+PERF_GAUGES = ["PercentAllocated", "MaxReadSize", "MaxWriteSize", "CacheSize"]
+
+
+def fake_objects(count, servers=2):
+    """
+    Synthetic DataCore Objects by resource, about count objects in total
+    """
+    objects = {}
+    objects["servers"] = [{"Id": "server-{}".format(i),
+                           "Caption": "SDS{}".format(i),
+                           "ExtendedCaption": "SDS{}".format(i),
+                           "RegionNodeId": "region-{}".format(i),
+                           "OsVersion": "Windows Server 2016",
+                           "ProductBuild": "15.0.1000.0",
+                           "ProductVersion": "10.0",
+                           "ProductName": "DataCore SANsymphony",
+                           "ProductType": "Full",
+                           "State": 2,
+                           "CacheState": 2,
+                           "PowerState": 2} for i in range(servers)]
+    objects["pools"] = [{"Id": "pool-{}".format(i),
+                         "Caption": "Pool{}".format(i // servers),
+                         "ExtendedCaption": "Pool{} on SDS{}".format(i // servers, i % servers),
+                         "ServerId": "server-{}".format(i % servers),
+                         "InSharedMode": False,
+                         "AutoTieringEnabled": True,
+                         "PoolStatus": 0,
+                         "TierReservedPct": 0,
+                         "ChunkSize": {"Value": 134217728},
+                         "MaxTierNumber": 3} for i in range(2 * servers)]
+
+    # Virtual disks are half of the objects, the rest goes to hosts, ports and disks
+    count = max(count - servers * 3, 4)
+    virtualdisks = count // 2
+    hosts = max(count * 15 // 100, 1)
+    physicaldisks = max(count * 20 // 100, 1)
+    ports = max(count - virtualdisks - hosts - physicaldisks, 1)
+
+    objects["hosts"] = [{"Id": "host-{}".format(i),
+                         "Caption": "esx{}".format(i),
+                         "ExtendedCaption": "esx{}".format(i),
+                         "MpioCapable": True,
+                         "AluaSupport": True,
+                         "State": 2} for i in range(hosts)]
+    objects["virtualdisks"] = [{"Id": "vd-{}".format(i),
+                                "Caption": "Virtual disk {}".format(i),
+                                "ExtendedCaption": "Virtual disk {}".format(i),
+                                "StorageProfileId": "profile",
+                                "ScsiDeviceIdString": "60030D90{:024d}".format(i),
+                                "Type": 2,
+                                "FirstHostId": "server-0",
+                                "SecondHostId": "server-{}".format(servers - 1),
+                                "DiskStatus": 0,
+                                "Size": {"Value": 1099511627776}} for i in range(virtualdisks)]
+    objects["physicaldisks"] = [{"Id": "disk-{}".format(i),
+                                 "Caption": "Disk {}".format(i),
+                                 "ExtendedCaption": "Disk {} on SDS{}".format(i, i % servers),
+                                 "HostId": "server-{}".format(i % servers),
+                                 "InquiryData": {"Serial": "SN{:08d}".format(i)},
+                                 "Type": 4,
+                                 "DiskStatus": 0} for i in range(physicaldisks)]
+    objects["ports"] = [{"Id": "port-{}".format(i),
+                         "Caption": "Port {}".format(i),
+                         "ExtendedCaption": "Port {} on esx{}".format(i, i % hosts),
+                         "HostId": "host-{}".format(i % hosts),
+                         "PortType": 2} for i in range(ports)]
+    return objects
+
+
+class FakeDataCoreHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body are sent in separate writes, avoid delayed ACK stalls
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, code, body=None):
+        data = json.dumps(body).encode("utf-8") if body is not None else b""
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        server = self.server
+        path = self.path.split("?")[0]
+        if path == "/ping":
+            return self.send_body(204)
+        if path == "/stats":
+            return self.send_body(200, server.snapshot())
+        if not path.startswith(REST_PREFIX):
+            return self.send_body(404)
+
+        server.count("requests")
+        if server.slots is not None:
+            with server.slots:
+                time.sleep(server.latency)
+        elif server.latency:
+            time.sleep(server.latency)
+
+        resource = path[len(REST_PREFIX):]
+        if resource.startswith("performance/"):
+            # Errors are only injected in perf queries, a failed listing aborts the cycle
+            if server.error_rate and random.random() < server.error_rate:
+                server.count("errors")
+                return self.send_body(500, {"ErrorCode": 500, "Message": "Fake error"})
+            dcs_id = resource[len("performance/"):]
+            if dcs_id not in server.ids:
+                return self.send_body(404, {"ErrorCode": 404, "Message": "Unknown Id"})
+            return self.send_body(200, [server.perf(dcs_id)])
+        if resource in server.objects:
+            return self.send_body(200, server.objects[resource])
+        return self.send_body(404, {"ErrorCode": 404, "Message": "Unknown resource"})
+
+    def do_POST(self):
+        server = self.server
+        data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if not self.path.startswith("/write"):
+            return self.send_body(404)
+        server.count("writes")
+        server.count("write_bytes", len(data))
+        if self.headers.get("Content-Encoding") == "gzip":
+            # Spool segments may hold several gzip members
+            data = gzip.GzipFile(fileobj=io.BytesIO(data)).read()
+        server.count("points", data.count(b"\n") + (1 if data and not data.endswith(b"\n") else 0))
+        server.count("point_bytes", len(data))
+        self.send_body(204)
+
+
+class FakeDataCoreServer(ThreadingMixIn, HTTPServer):
+    """
+    Threaded fake REST server, counts are kept in stats
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, count, latency=0, error_rate=0, capacity=0):
+        HTTPServer.__init__(self, address, FakeDataCoreHandler)
+        self.objects = fake_objects(count)
+        self.ids = set(item["Id"] for items in self.objects.values() for item in items)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.slots = threading.Semaphore(capacity) if capacity else None
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0, "writes": 0,
+                      "write_bytes": 0, "points": 0, "point_bytes": 0}
+        self.started = time.time()
+
+    def count(self, key, value=1):
+        with self.lock:
+            self.stats[key] += value
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.stats)
+        stats["objects"] = len(self.ids)
+        return stats
+
+    def perf(self, dcs_id):
+        """
+        Counters growing with time, at a per object pace
+        """
+        now = time.time()
+        pace = 1 + zlib.crc32(dcs_id.encode("utf-8")) % 1000
+        perf = {"CollectionTime": "/Date({})/".format(int(now * 1000))}
+        elapsed = now - self.started
+        for i, counter in enumerate(PERF_COUNTERS):
+            perf[counter] = int(elapsed * pace * (i + 1))
+        for gauge in PERF_GAUGES:
+            perf[gauge] = pace / 10.0
+        return perf
+
+
+def serve(port, count, latency=0, error_rate=0, capacity=0):
+    """
+    Start a fake server in a background thread, return it
+    """
+    server = FakeDataCoreServer(("127.0.0.1", port), count, latency, error_rate, capacity)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Fake DataCore REST server and InfluxDB endpoint")
+    parser.add_argument("--port", type=int, default=8080,
+                        help="listen port on 127.0.0.1 (default: %(default)s)")
+    parser.add_argument("--count", type=int, default=1000,
+                        help="number of DataCore Objects (default: %(default)s)")
+    parser.add_argument("--latency", type=float, default=0,
+                        help="seconds added to each REST response (default: %(default)s)")
+    parser.add_argument("--error-rate", type=float, default=0,
+                        help="fraction of perf requests answered with a 500 (default: %(default)s)")
+    parser.add_argument("--capacity", type=int, default=0,
+                        help="REST requests served at once, 0 for no limit (default: %(default)s)")
+    args = parser.parse_args()
+
+    server = FakeDataCoreServer(("127.0.0.1", args.port), args.count, args.latency, args.error_rate,
+                                args.capacity)
+    print("Serving {} objects on 127.0.0.1:{}".format(len(server.ids), args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -31,40 +31,140 @@ try:
 except:
     msg_error_import("futures")
 try:
-    from concurrent.futures import ProcessPoolExecutor
+    import queue
 except:
-    msg_error_import("concurrent")
+    try:
+        import Queue as queue
+    except:
+        msg_error_import("queue")
+try:
+    import collections
+except:
+    msg_error_import("collections")
+try:
+    import itertools
+except:
+    msg_error_import("itertools")
+try:
+    import codecs
+except:
+    msg_error_import("codecs")
 
 
 
-# Read config file
-config = configparser.ConfigParser()
 try:
-    config.read('/etc/datacore/datacore_get_perf.ini')
+    import os
 except:
-    print("Config file (datacore_get_perf.ini) not found")
-    sys.exit(1)
+    msg_error_import("os")
+try:
+    import zlib
+except:
+    msg_error_import("zlib")
+try:
+    import fnmatch
+except:
+    msg_error_import("fnmatch")
+try:
+    import math
+except:
+    msg_error_import("math")
+try:
+    import re
+except:
+    msg_error_import("re")
+try:
+    import argparse
+except:
+    msg_error_import("argparse")
+try:
+    import signal
+except:
+    msg_error_import("signal")
+try:
+    import threading
+except:
+    msg_error_import("threading")
+try:
+    import time
+except:
+    msg_error_import("time")
+try:
+    import socket
+except:
+    msg_error_import("socket")
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except:
+    try:
+        from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+        from SocketServer import ThreadingMixIn
+    except:
+        msg_error_import("http.server")
+try:
+    import ssl
+except:
+    msg_error_import("ssl")
+try:
+    import cProfile
+except:
+    msg_error_import("cProfile")
+# Python 3 only, cycle profiles have no memory snapshot without it
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+# Only needed with [VSPHERE] enabled, see dcs_vsphere()
+try:
+    from pyVim.connect import SmartConnect, Disconnect
+    from pyVmomi import vim, vmodl
+except ImportError:
+    vim = None
+
+
+
+# Config file, read by load_config()
+config = configparser.ConfigParser()
+
+
+def load_config(config_file):
+    """
+    Read config file, enable logging and construct the InfluxDB url
+    """
+    global url_influxdb
+
+    if not config.read(config_file):
+        print("Config file ({}) not found".format(config_file))
+        sys.exit(1)
 
-# Enable logging
-if config['LOGGING'].getboolean('log'):
-    logging.basicConfig(filename=config['LOGGING']['logfile'],
-                        format='%(asctime)s - %(message)s',
-                        level=logging.INFO)
-else:
-    logging.basicConfig(format='%(asctime)s - %(message)s')
+    # Enable logging
+    if config['LOGGING'].getboolean('log'):
+        logging.basicConfig(filename=config['LOGGING']['logfile'],
+                            format='%(asctime)s - %(message)s',
+                            level=logging.INFO)
+    else:
+        logging.basicConfig(format='%(asctime)s - %(message)s')
+
+    url_influxdb ='http://{}:{}/write?db=DataCoreRestDB'.format(config['SERVERS']['influxdb_server'],
+                                                           config['SERVERS']['influxdb_port'])
 
-# Construct rest url and headers
-url = "http://{}/RestService/rest.svc/1.0".format(config['SERVERS']['rest_server'])
-headers = {'ServerHost': config['SERVERS']['datacore_server'],
-           'Authorization': 'Basic {} {}'.format(config['CREDENTIALS']['user'],
-                                                 config['CREDENTIALS']['passwd'])}
 
 
+# InfluxDB write status
 
+WRITE_OK = 0
+WRITE_RETRY = 1
+WRITE_REJECTED = 2
 
-url_influxdb ='http://{}:{}/write?db=DataCoreRestDB'.format(config['SERVERS']['influxdb_server'],
-                                                       config['SERVERS']['influxdb_port'])
 
+# Python 2/3 compatibility
+
+try:
+    DCS_INTEGER_TYPES = (int, long)
+    DCS_TEXT_TYPES = (str, unicode)
+except NameError:
+    DCS_INTEGER_TYPES = (int,)
+    DCS_TEXT_TYPES = (str,)
 
 
 # lambdas
@@ -74,437 +174,2231 @@ dcs_b2g = lambda value:value/1024/1024/1024 # Convert Bytes to GigaBytes
 #dcs_request_perf = lambda value:requests.get('{}/performance/{}'.format(url,value), headers=headers) # request perf from dcs_object Id
 
 
-# fuctions
+# classes
 
-def print_cool(msg):
-    msg = "  " + msg + "  "
-    print("".center(80,"#"))
-    print(msg.center(80,"#"))
-    print("".center(80,"#"))
-    print("\n")
+class DcsRestClient(object):
+    """
+    Keep-alive session to the DataCore REST server
 
-def dcs_monitorid_to_str(i):
+    Connections are pooled and reused between requests and cycles, the
+    number of requests in flight is bounded by max_inflight and every
+    request has a (connect, read) timeout. Perf requests are further
+    bounded by concurrency (see DcsConcurrency).
     """
-    Helper that convert a monitor state int to a str.
+
+    def __init__(self, url, headers, max_inflight, timeout, concurrency=None):
+        self.url = url
+        self.timeout = timeout
+        self.max_inflight = max_inflight
+        if concurrency is None:
+            concurrency = DcsConcurrency(max_inflight, max_inflight, float("inf"), 1)
+        self.concurrency = concurrency
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                pool_maxsize=max_inflight)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_inflight)
+        self.latencies = []
+
+    def get(self, path, stream=False):
+        start = time.time()
+        try:
+            return self.session.get('{}/{}'.format(self.url, path), timeout=self.timeout, stream=stream)
+        finally:
+            self.latencies.append(time.time() - start)
+
+    def take_latencies(self):
+        """
+        Latencies of the requests since the previous call
+        """
+        latencies, self.latencies = self.latencies, []
+        return latencies
+
+    def close(self):
+        self.executor.shutdown()
+        self.session.close()
+
+
+class DcsConcurrency(object):
     """
-    if i == 1:
-        return "Undefined"
-    elif i == 2:
-        return "Healthy"
-    elif i == 4:
-        return "Attention"
-    elif i == 8:
-        return "Warning"
-    elif i == 16:
-        return "Critical"
-    else:
-        return "Undefined"
+    Limit of perf requests in flight, adapted to the REST server (AIMD)
+
+    The limit starts at floor. Every limit completed requests, it is
+    multiplied by backoff if their mean latency is over latency_target
+    or more than error_rate of them failed, else it grows by one, within
+    floor and ceiling. Requests sent before a decrease are not accounted,
+    they were sent at the previous limit.
+    """
+
+    def __init__(self, floor, ceiling, latency_target, error_rate, backoff=0.5):
+        self.floor = max(floor, 1)
+        self.ceiling = max(ceiling, self.floor)
+        self.latency_target = latency_target
+        self.error_rate = error_rate
+        self.backoff = backoff
+        self.limit = self.floor
+        self.decreased = 0
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.seconds = 0.0
+
+    def observe(self, seconds, failed=False):
+        """
+        Account a completed request, adapt the limit at the end of a window
+        """
+        now = time.time()
+        with self.lock:
+            if now - seconds < self.decreased:
+                return
+            self.requests += 1
+            self.seconds += seconds
+            if failed:
+                self.errors += 1
+            if self.requests < self.limit:
+                return
+            latency = self.seconds / self.requests
+            limit = self.limit
+            if latency > self.latency_target or self.errors > self.error_rate * self.requests:
+                self.limit = max(self.floor, int(self.limit * self.backoff))
+                self.decreased = now
+            else:
+                self.limit = min(self.ceiling, self.limit + 1)
+            if self.limit != limit:
+                logging.info("Perf requests in flight limit {} -> {} (mean latency {:.3f}s, {}/{} errors)".format(
+                    limit, self.limit, latency, self.errors, self.requests))
+            self.requests = 0
+            self.errors = 0
+            self.seconds = 0.0
+
+
+# Keys of DataCore Objects read by the encoder, nested objects keep
+# only the listed keys
+DCS_OBJECT_KEYS = {
+    "Id": None, "Caption": None, "ExtendedCaption": None,
+    "State": None, "CacheState": None, "PowerState": None,
+    "OsVersion": None, "ProductBuild": None, "ProductVersion": None,
+    "ProductName": None, "ProductType": None,
+    "ServerId": None, "InSharedMode": None, "AutoTieringEnabled": None,
+    "PoolStatus": None, "TierReservedPct": None, "ChunkSize": ("Value",),
+    "MaxTierNumber": None,
+    "StorageProfileId": None, "ScsiDeviceIdString": None, "Type": None,
+    "FirstHostId": None, "SecondHostId": None, "DiskStatus": None,
+    "Size": ("Value",), "InquiryData": ("Serial",), "HostId": None,
+    "ServerPortProperties": ("Role",), "__type": None, "PortType": None,
+    "MpioCapable": None, "AluaSupport": None,
+}
 
 
+def dcs_slot(key):
+    # Slots starting with __ would be name mangled
+    return "x" + key if key.startswith("__") else key
 
-def dcs_get_object(dcs_object):
+
+class DcsObject(object):
     """
-    Get DataCore Object (ex: servers, virtualdisks...)
+    Compact DataCore Object holding only DCS_OBJECT_KEYS
+
+    Reads like the parsed JSON dict (obj["Caption"], obj.get("__type"))
+    at a fraction of its memory.
     """
-    logging.info('Begin to query the REST server at {}'.format(config['SERVERS']['rest_server']))
-    
-    try:
-        r = requests.get('{}/{}'.format(url,dcs_object), headers=headers)
-    except:
-        logging.error("Something wrong during connection")
-        sys.exit(1)
-    else:
-        logging.info("Querying {}".format(dcs_object))
-        tmp = r.json()
-        result = []
+
+    __slots__ = [dcs_slot(key) for key in DCS_OBJECT_KEYS] + ["dcs_resource", "Performances"]
+
+    @classmethod
+    def from_json(cls, item, resource):
+        obj = cls()
+        for key, nested in DCS_OBJECT_KEYS.items():
+            if key in item:
+                value = item[key]
+                if nested is not None and isinstance(value, dict):
+                    value = dict((k, value[k]) for k in nested if k in value)
+                setattr(obj, dcs_slot(key), value)
+        obj.dcs_resource = resource
+        return obj
+
+    def __getitem__(self, key):
         try:
-            err = tmp["ErrorCode"]
-        except:
-            logging.info("No Rest ErrorCode")
-        else:
-            logging.error(tmp["Message"])
-            sys.exit(1)
-        if dcs_object == "servers":
-            for item in tmp:
-                test = str(item["RegionNodeId"])
-                if str(test) != "None":
-                    item["dcs_resource"] = dcs_object
-                    result.append(item)
-                else:
-                    logging.warning("Exception: Partner server: " +item["Caption"])
-            return result
-        elif dcs_object == "ports":      
-            for item in tmp:
-                if "Microsoft iSCSI" in item["Caption"] or "Loop" in item["Caption"]:
-                    test = 1
-                else:
-                    item["dcs_resource"] = dcs_object
-                    result.append(item)
-            return result
-        elif dcs_object == "physicaldisks":
-            for item in tmp:
-                if item["Type"] == 4:
-                    item["dcs_resource"] = dcs_object
-                    result.append(item)
-            return result
-        else:
-            for item in tmp:
-                item["dcs_resource"] = dcs_object
-                result.append(item)
-            return result
+            return getattr(self, dcs_slot(key))
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        setattr(self, dcs_slot(key), value)
 
+    def get(self, key, default=None):
+        return getattr(self, dcs_slot(key), default)
 
+    def copy(self):
+        obj = DcsObject()
+        for slot in self.__slots__:
+            if hasattr(self, slot):
+                setattr(obj, slot, getattr(self, slot))
+        return obj
 
-def dcs_request_perf(dcs_object):
-    res = requests.get('{}/performance/{}'.format(url,dcs_object["Id"]), headers=headers)
-    logging.info("Querying perf for {}".format(dcs_object["Caption"]))
-    dcs_object["Performances"] = res.json()[0]
-    return dcs_object
 
-def dcs_get_perf(dcs_objects):
+class DcsInventory(object):
     """
-    Get DataCore Objects performances (ex: servers, virtualdisks...)
+    Cache of DataCore Objects lists (ex: servers, virtualdisks...)
+
+    Each resource is listed again once its refresh interval has elapsed
+    or after invalidate(), so steady-state cycles only query perf.
     """
 
-    logging.info('Begin to query the REST server for perf at {}'.format(config['SERVERS']['rest_server']))
+    def __init__(self, client, refresh, refresh_resources):
+        self.client = client
+        self.refresh = refresh
+        self.refresh_resources = refresh_resources
+        self.objects = {}
+        self.expires = {}
+        self.generations = {}
+        self.indexes = {}
+        self.reported = {}
 
-    result = []
-    with ProcessPoolExecutor() as executor:
-        for  dcs_perf in zip(dcs_objects, executor.map(dcs_request_perf, dcs_objects)):
-            result.append(dcs_perf[1])
-    return result
+    def get(self, resource):
+        if time.time() >= self.expires.get(resource, 0):
+            self.objects[resource] = dcs_get_object(self.client, resource)
+            self.expires[resource] = time.time() + self.refresh_resources.get(resource, self.refresh)
+            self.generations[resource] = self.generations.get(resource, 0) + 1
+        return self.objects[resource]
+
+    def index(self, *resources):
+        """
+        Id -> object index over resources, rebuilt only after a refresh
+        """
+        items = [self.get(resource) for resource in resources]
+        generation = tuple(self.generations[resource] for resource in resources)
+        cached = self.indexes.get(resources)
+        if cached is None or cached[0] != generation:
+            index = {}
+            for objects in items:
+                for item in objects:
+                    index[item["Id"]] = item
+            cached = self.indexes[resources] = (generation, index)
+        return cached[1]
 
+    def listed(self, resource):
+        """
+        True once after each listing of resource, to report it in DataCore_Inventory
+        """
+        generation = self.generations.get(resource)
+        if self.reported.get(resource) == generation:
+            return False
+        self.reported[resource] = generation
+        return True
 
-def dcs_caption_from_id(dcs_id,dcs_json_data):
+    def invalidate(self, resource):
+        if self.expires.pop(resource, None) is not None:
+            logging.info("Inventory of {} invalidated".format(resource))
+
+
+class InfluxWriter(object):
+    """
+    Write line protocol to InfluxDB in size-bounded, gzip compressed batches
+
+    Batches hold at most batch_points lines and batch_bytes bytes, they
+    are posted over a keep-alive session and retried with exponential
+    backoff on connection errors, 429 and 5xx responses. With a spool,
+    batches are posted once and spooled if that fails: during an outage,
+    while the spool is not empty, later batches go straight to the spool
+    and only the spool drain retries, so cycles are never held up. Small
+    writes (merge) join the newest segment instead of adding one.
     """
-    Find Caption from an DataCore Id
-    """ 
-    for item in dcs_json_data:
-        if item["Id"] == dcs_id:
-            return str(item["Caption"])
 
+    def __init__(self, url, batch_points, batch_bytes, compress, retries, backoff, timeout, spool=None):
+        self.url = url
+        self.batch_points = batch_points
+        self.batch_bytes = batch_bytes
+        self.compress = compress
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.spool = spool
+        self.outage = False
+        self.session = requests.Session()
 
+    def batches(self, lines):
+        batch = []
+        size = 0
+        for line in lines:
+            line = line.encode('utf-8')
+            if batch and (len(batch) >= self.batch_points or size + len(line) > self.batch_bytes):
+                yield batch
+                batch = []
+                size = 0
+            batch.append(line)
+            size += len(line) + 1
+        if batch:
+            yield batch
 
+    def write(self, lines, stats=None, merge=False):
+        """
+        Write lines, return the number of points that could not be written
+        """
+        failed = 0
+        spooling = False
+        for batch in self.batches(lines):
+            body = b"\n".join(batch)
+            data = gzip_compress(body) if self.compress else body
+            queued = self.spool is not None and (spooling or self.outage or self.spool.size > 0)
+            if queued:
+                status = WRITE_RETRY
+                if not spooling and not self.outage:
+                    logging.info("Spool not empty, queueing points behind its backlog")
+            else:
+                start = time.time()
+                status = self.send(data, self.compress, len(batch), len(body),
+                                   0 if self.spool is not None else self.retries)
+                if stats is not None:
+                    stats.count("write_seconds", time.time() - start)
+                if status == WRITE_RETRY and self.spool is not None:
+                    logging.warning("InfluxDB unavailable, spooling until the spool is drained")
+                    self.outage = True
+            if status == WRITE_RETRY and self.spool is not None:
+                spooling = True
+                self.spool.append(data if self.compress else gzip_compress(body), len(batch), merge)
+                if stats is not None:
+                    stats.count("spooled_points", len(batch))
+            elif status != WRITE_OK:
+                failed += len(batch)
+            elif stats is not None:
+                stats.count("points", len(batch))
+                stats.count("bytes", len(body))
+                stats.count("sent_bytes", len(data))
+        if stats is not None:
+            stats.count("failed_points", failed)
+        return failed
 
+    def send(self, data, compressed, points, size, retries=None):
+        """
+        Post a batch, return WRITE_OK, WRITE_RETRY or WRITE_REJECTED
+        """
+        headers = {}
+        if compressed:
+            headers['Content-Encoding'] = 'gzip'
 
-def put_in_influxdb(datas):
+        for attempt in range((self.retries if retries is None else retries) + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            start = time.time()
+            try:
+                req = self.session.post(self.url, data=data, headers=headers, timeout=self.timeout)
+            except requests.exceptions.RequestException as e:
+                logging.warning("InfluxDB write failed (attempt {}): {}".format(attempt + 1, e))
+                continue
+            latency = time.time() - start
+            if req.status_code >= 200 and req.status_code < 300:
+                logging.info("Wrote {} points, {} bytes ({} sent) in {:.3f}s".format(
+                    points, size, len(data), latency))
+                return WRITE_OK
+            logging.error("A problem occurs... Response code was {}".format(req.status_code))
+            logging.error(req.text)
+            if req.status_code != 429 and req.status_code < 500:
+                # Bad request: retrying does not help
+                return WRITE_REJECTED
+        return WRITE_RETRY
 
-    result = []
+    def healthy(self):
+        try:
+            req = self.session.get(self.url.replace('/write', '/ping').split('?')[0],
+                                   timeout=self.timeout)
+        except requests.exceptions.RequestException:
+            return False
+        return req.status_code == 204
 
-    for data in datas:
-        if "servers" in data["dcs_resource"]:
-            line = "{},instance={},objectname={},host={}{} {} {}"
-            table = "DataCore_Servers"
-            objectname = "DataCore\ Servers"
-            instance = str(data["ExtendedCaption"].encode("ascii","ignore").strip()).replace(" ", "\\ ").replace(",", "\\ ")
-            host = str(data["Caption"].encode("ascii","ignore").strip()).replace(" ", "\\ ").replace(",", "\\ ")
-            # Add specific info
-            add_info = ",id=" + str(data["Id"])
-            add_info += ",OsVersion=" + str(data["OsVersion"].encode("ascii","ignore").strip()).replace(" ", "\\ ").replace(",", "\\ ")
-            add_info += ",ProductBuild=" + str(data["ProductBuild"].encode("ascii","ignore").strip()).replace(" ", "\\ ").replace(",", "\\ ")
-            add_info += ",ProductVersion=" + str(data["ProductVersion"].encode("ascii","ignore").strip()).replace(" ", "\\ ").replace(",", "\\ ")
-            add_info += ",ProductName=" + str(data["ProductName"].encode("ascii","ignore").strip()).replace(" ", "\\ ").replace(",", "\\ ")
-            add_info += ",ProductType=" + str(data["ProductType"].encode("ascii","ignore").strip()).replace(" ", "\\ ").replace(",", "\\ ")
-            add_info += ",Caption=" + str(data["Caption"].encode("ascii","ignore").strip()).replace(" ", "\\ ").replace(",", "\\ ")
-            for k,v in data["Performances"].items():
-                if int(data["Performances"]["CollectionTime"][6:-2])*1000000 < 0:
-                    logging.error("TimeCollection error")
+    def close(self):
+        self.session.close()
+
+
+class LineWriter(InfluxWriter):
+    """
+    Write line protocol to a stream instead of InfluxDB
+
+    Used as a telegraf [[inputs.execd]] plugin: batching, buffering and
+    retries are telegraf's. Batches of concurrent targets are not mixed.
+    """
+
+    def __init__(self, stream, batch_points):
+        InfluxWriter.__init__(self, None, batch_points, 4194304, False, 0, 0, 0)
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def send(self, data, compressed, points, size, retries=None):
+        try:
+            with self.lock:
+                self.stream.write(data + b"\n")
+                self.stream.flush()
+        except (IOError, OSError) as e:
+            logging.error("Line protocol output failed: {}".format(e))
+            return WRITE_REJECTED
+        return WRITE_OK
+
+    def healthy(self):
+        return True
+
+
+class InfluxSpool(object):
+    """
+    On-disk queue of batches that could not be written to InfluxDB
+
+    Each batch is a gzip segment file named after its spool time, so
+    segments sort oldest first. When the spool grows over max_bytes the
+    oldest segments are evicted.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.sequence = 0
+        self.draining = None
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.size = sum(os.path.getsize(os.path.join(directory, name)) for name in self.segments())
+
+    def segments(self):
+        return sorted(name for name in os.listdir(self.directory) if name.endswith('.lp.gz'))
+
+    def append(self, data, points, merge=False):
+        """
+        Add a segment, or with merge add data to the newest segment as
+        more gzip members, unless it is being drained
+        """
+        with self.lock:
+            segments = self.segments()
+            if merge and segments and segments[-1] != self.draining:
+                prefix, count = segments[-1].rsplit('-', 1)
+                path = os.path.join(self.directory, segments[-1])
+                with open(path, 'ab') as segment:
+                    # Segments do not end with a newline
+                    segment.write(gzip_compress(b"\n") + data)
+                os.rename(path, os.path.join(self.directory, "{}-{}.lp.gz".format(
+                    prefix, int(count.split('.')[0]) + points)))
+                self.size += len(data)
+                return
+
+            self.sequence += 1
+            name = "{:020d}-{:06d}-{}.lp.gz".format(int(time.time() * 1e9), self.sequence, points)
+            path = os.path.join(self.directory, name)
+            with open(path + '.tmp', 'wb') as segment:
+                segment.write(data)
+            os.rename(path + '.tmp', path)
+            self.size += len(data)
+            logging.warning("Spooled {} points ({} bytes spooled)".format(points, self.size))
+
+            segments = self.segments()
+            while self.size > self.max_bytes and len(segments) > 1:
+                self.remove(segments.pop(0), "Spool full, dropped")
+
+    def remove(self, name, reason):
+        path = os.path.join(self.directory, name)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        self.size -= size
+        logging.info("{} {} points".format(reason, name.split('-')[-1].split('.')[0]))
+
+    def drain(self, writer, stop, max_batches, rate):
+        """
+        Write back up to max_batches segments, at most rate per second
+        """
+        drained = 0
+        try:
+            while drained < max_batches and not stop.is_set():
+                with self.lock:
+                    segments = self.segments()
+                    if not segments:
+                        self.size = 0
+                        if writer.outage:
+                            writer.outage = False
+                            logging.info("Spool drained, writing to InfluxDB again")
+                        break
+                    # Not merged into while it is sent
+                    name = self.draining = segments[0]
+                if not writer.healthy():
                     break
-                if "CollectionTime" in k:
-                    continue
-                result.append(line.format(
-                    table,
-                    instance,
-                    objectname,
-                    host,
-                    add_info,
-                    "=".join([str(k), str(v)]),
-                    int(data["Performances"]["CollectionTime"][6:-2])*1000000
-                ))
-            result.append(line.format(
-                table,
-                instance,
-                objectname,
-                host,
-                add_info,
-                "=".join(["State", str(data["State"])]),
-                int(data["Performances"]["CollectionTime"][6:-2])*1000000
-            ))
-            result.append(line.format(
-                table,
-                instance,
-                objectname,
-                host,
-                add_info,
-                "=".join(["CacheState", str(data["CacheState"])]),
-                int(data["Performances"]["CollectionTime"][6:-2])*1000000
-            ))
-            result.append(line.format(
-                table,
-                instance,
-                objectname,
-                host,
-                add_info,
-                "=".join(["PowerState", str(data["PowerState"])]),
-                int(data["Performances"]["CollectionTime"][6:-2])*1000000
-            ))
-        elif "pools" in data["dcs_resource"]:
-            line = "{},instance={},objectname={},host={}{} {} {}"
-            table = "DataCore_Disk_pools"
-            objectname = "DataCore\ Disk\ pools"
-            instance = str(data["ExtendedCaption"].encode("ascii","ignore").strip()).replace(" ", "\\ ").replace(",", "\\ ")
-            host = str(dcs_caption_from_id(data["ServerId"],dcs_servers))
-            host = host.replace(" ", "\\ ")
-            # Add specific info
-            add_info = ",id=" + str(data["Id"])
-            add_info += ",InSharedMode=" + str(data["InSharedMode"])
-            add_info += ",AutoTieringEnabled=" + str(data["AutoTieringEnabled"])
-            add_info += ",Caption=" + str(data["Caption"].encode("ascii","ignore").strip()).replace(" ", "\\ ").replace(",", "\\ ")
-            for k,v in data["Performances"].items():
-                if int(data["Performances"]["CollectionTime"][6:-2])*1000000 < 0:
-                    logging.error("TimeCollection error")
+                try:
+                    with open(os.path.join(self.directory, name), 'rb') as segment:
+                        data = segment.read()
+                except (IOError, OSError) as e:
+                    logging.error("Can not read spool segment {}: {}".format(name, e))
                     break
-                if "CollectionTime" in k:
-                    continue
-                result.append(line.format(
-                    table,
-                    instance,
-                    objectname,
-                    host,
-                    add_info,
-                    "=".join([str(k), str(v)]),
-                    int(data["Performances"]["CollectionTime"][6:-2])*1000000
-                ))
-            result.append(line.format(
-                table,
-                instance,
-                objectname,
-                host,
-                add_info,
-                "=".join(["PoolStatus", str(data["PoolStatus"])]),
-                int(data["Performances"]["CollectionTime"][6:-2])*1000000
-            ))
-            result.append(line.format(
-                table,
-                instance,
-                objectname,
-                host,
-                add_info,
-                "=".join(["TierReservedPct", str(data["TierReservedPct"])]),
-                int(data["Performances"]["CollectionTime"][6:-2])*1000000
-            ))
-            result.append(line.format(
-                table,
-                instance,
-                objectname,
-                host,
-                add_info,
-                "=".join(["ChunkSize", str(data["ChunkSize"]["Value"])]),
-                int(data["Performances"]["CollectionTime"][6:-2])*1000000
-            ))
-            result.append(line.format(
-                table,
-                instance,
-                objectname,
-                host,
-                add_info,
-                "=".join(["MaxTierNumber", str(data["MaxTierNumber"])]),
-                int(data["Performances"]["CollectionTime"][6:-2])*1000000
-            ))
-        elif "virtualdisks" in data["dcs_resource"]:
-            if data["StorageProfileId"] != None:
-                line = "{},instance={},objectname={},host={}{} {} {}"
-                table = "DataCore_Virtual_Disks"
-                objectname = "DataCore\ Virtual\ disks"
-                instance = str(data["ExtendedCaption"].encode("ascii","ignore").strip()).replace(" ", "\\ ").replace(",", "\\ ")
-                host = 'NA'
-                # Add specific info
-                add_info = ",id=" + str(data["Id"])
-                add_info += ",ScsiDeviceIdString=" + str(data["ScsiDeviceIdString"])
-                add_info += ",Type=" + str(data["Type"])
-                if data["FirstHostId"] != None:
-                    add_info += ",FirstHost=" + str(dcs_caption_from_id(data["FirstHostId"],dcs_servers))
-                if data["SecondHostId"] != None:
-                    add_info += ",SecondHost=" + str(dcs_caption_from_id(data["SecondHostId"],dcs_servers))
-                add_info += ",Caption=" + str(data["Caption"].encode("ascii","ignore").strip()).replace(" ", "\\ ").replace(",", "\\ ")
-                for k,v in data["Performances"].items():
-                    if int(data["Performances"]["CollectionTime"][6:-2])*1000000 < 0:
-                        logging.error("TimeCollection error")
-                        break
-                    if "CollectionTime" in k:
-                        continue
-                    result.append(line.format(
-                        table,
-                        instance,
-                        objectname,
-                        host,
-                        add_info,
-                        "=".join([str(k), str(v)]),
-                        int(data["Performances"]["CollectionTime"][6:-2])*1000000
-                    ))
-                result.append(line.format(
-                        table,
-                        instance,
-                        objectname,
-                        host,
-                        add_info,
-                        "=".join(["DiskStatus", str(data["DiskStatus"])]),
-                        int(data["Performances"]["CollectionTime"][6:-2])*1000000
-                    ))
-                result.append(line.format(
-                        table,
-                        instance,
-                        objectname,
-                        host,
-                        add_info,
-                        "=".join(["Size", str(data["Size"]["Value"])]),
-                        int(data["Performances"]["CollectionTime"][6:-2])*1000000
-                    ))
-        elif "physicaldisks" in data["dcs_resource"]:
-            line = "{},instance={},objectname={},host={}{} {} {}"
-            table = "DataCore_Physical_disk"
-            objectname = "DataCore\ Physical\ disk"
-            instance = str(data["ExtendedCaption"].encode("ascii","ignore").strip()).replace(" ", "\\ ").replace(",", "\\ ")
-            host = str(dcs_caption_from_id(data["HostId"],dcs_servers_hosts))
-            host = host.replace(" ", "\\ ")
-            # Add specific info
-            add_info = ",id=" + data["Id"]
-            if data["InquiryData"]["Serial"] != None:
-                add_info += ",Serial=" + str(data["InquiryData"]["Serial"].encode("ascii","ignore").strip()).replace(" ", "\\ ").replace(",", "\\ ")
-            else:
-                add_info += ",Serial=UNKNOWN"
-            add_info += ",Type=" + str(data["Type"])
-            add_info += ",Caption=" + str(data["Caption"].encode("ascii","ignore").strip()).replace(" ", "\\ ").replace(",", "\\ ")
-            for k,v in data["Performances"].items():
-                if int(data["Performances"]["CollectionTime"][6:-2])*1000000 < 0:
-                    logging.error("TimeCollection error")
+                points = int(name.split('-')[-1].split('.')[0])
+                status = writer.send(data, True, points, len(data))
+                if status == WRITE_RETRY:
                     break
-                if "CollectionTime" in k:
-                    continue
-                result.append(line.format(
-                    table,
-                    instance,
-                    objectname,
-                    host,
-                    add_info,
-                    "=".join([str(k), str(v)]),
-                    int(data["Performances"]["CollectionTime"][6:-2])*1000000
-                ))
-            result.append(line.format(
-                    table,
-                    instance,
-                    objectname,
-                    host,
-                    add_info,
-                    "=".join(["DiskStatus", str(data["DiskStatus"])]),
-                    int(data["Performances"]["CollectionTime"][6:-2])*1000000
-                ))
-        elif "ports" in data["dcs_resource"]:
-            line = "{},instance={},objectname={},host={}{} {} {}"
-            table = "DataCore_SCSI_ports"
-            objectname = "DataCore\ SCSI\ ports"
-            instance = str(data["ExtendedCaption"].encode("ascii","ignore").strip()).replace(" ", "\\ ").replace(",", "\\ ")
-            if data["HostId"] != None:
-                host = str(dcs_caption_from_id(data["HostId"],dcs_servers_hosts))
-                host = host.replace(" ", "\\ ")
+                with self.lock:
+                    self.remove(name, "Spool drained" if status == WRITE_OK else "Spool rejected")
+                    self.draining = None
+                drained += 1
+                stop.wait(1.0 / rate)
+        finally:
+            self.draining = None
+        return drained
+
+    def run(self, writer, stop, rate, interval):
+        """
+        Background drain until stop is set
+        """
+        while not stop.is_set():
+            self.drain(writer, stop, float('inf'), rate)
+            stop.wait(interval)
+
+
+class DcsRates(object):
+    """
+    Per-second rates of cumulative DataCore counters
+
+    The previous sample of each object Id is kept between cycles. A
+    counter lower than its previous value was reset and gets no rate for
+    this sample, neither do samples with an unchanged CollectionTime or
+    more than max_gap seconds after the previous one.
+    """
+
+    def __init__(self, patterns, max_gap):
+        self.patterns = patterns
+        self.max_gap = max_gap
+        self.previous = {}
+        self.counters = {}
+        self.latest = 0
+
+    def is_counter(self, field):
+        if field not in self.counters:
+            self.counters[field] = any(fnmatch.fnmatchcase(field, pattern) for pattern in self.patterns)
+        return self.counters[field]
+
+    def add_rates(self, dcs_id, fields, timestamp):
+        """
+        Add <counter>_rate fields computed from the previous sample
+        """
+        counters = dict((k, v) for k, v in fields.items()
+                        if isinstance(v, DCS_INTEGER_TYPES + (float,)) and not isinstance(v, bool)
+                        and self.is_counter(k))
+        previous = self.previous.get(dcs_id)
+        if previous is not None and timestamp <= previous[0]:
+            # Same sample as the previous cycle
+            return
+        self.previous[dcs_id] = (timestamp, counters)
+        self.latest = max(self.latest, timestamp)
+        if previous is None:
+            return
+
+        elapsed = (timestamp - previous[0]) / 1e9
+        if elapsed > self.max_gap:
+            return
+        for k, v in counters.items():
+            before = previous[1].get(k)
+            if before is not None and v >= before:
+                fields[k + "_rate"] = (v - before) / elapsed
+
+    def prune(self):
+        """
+        Forget objects without sample for max_gap seconds
+        """
+        oldest = self.latest - self.max_gap * 1e9
+        for dcs_id in [k for k, v in self.previous.items() if v[0] < oldest]:
+            del self.previous[dcs_id]
+
+
+class DcsStates(object):
+    """
+    Change-suppressed writes of slow-moving state fields
+
+    The last written value of each state field is kept by object Id, a
+    field is written again when it changes or heartbeat seconds after it
+    was last written. The first heartbeat of an object is shifted by a
+    hash of its Id, so objects listed together do not all rewrite their
+    states at the same cycle. Values encoded in a cycle are staged and
+    only recorded as written by commit() once the cycle is written.
+    """
+
+    def __init__(self, fields, heartbeat):
+        self.fields = frozenset(fields)
+        self.heartbeat = heartbeat * 1e9
+        self.written = {}
+        self.staged = []
+        self.latest = 0
+
+    def changed(self, dcs_id, fields, timestamp):
+        """
+        Fields without the state fields unchanged since their last write,
+        and the number of fields left out
+        """
+        seen = self.written.get(dcs_id)
+        if seen is None:
+            # [last sample, {field: (value, written)}, first heartbeat shift]
+            shift = (zlib.crc32(dcs_id.encode('utf-8')) & 0xffffffff) % max(int(self.heartbeat // 1e9), 1)
+            seen = self.written[dcs_id] = [timestamp, {}, shift * 1e9]
+        seen[0] = timestamp
+        self.latest = max(self.latest, timestamp)
+        written = seen[1]
+        unchanged = []
+        for k in self.fields.intersection(fields):
+            previous = written.get(k)
+            if previous is not None and previous[0] == fields[k] and timestamp - previous[1] < self.heartbeat:
+                unchanged.append(k)
             else:
-                host = 'NA'
-            # Add specific info
-            add_info = ",id=" + str(data["Id"])
+                self.staged.append((written, k, (fields[k], timestamp - seen[2] if previous is None else timestamp)))
+        if not unchanged:
+            return fields, 0
+        return dict((k, v) for k, v in fields.items() if k not in unchanged), len(unchanged)
+
+    def commit(self, written):
+        """
+        Record the values staged since the last commit if they were
+        written, otherwise they are written again next cycle
+        """
+        if written:
+            for values, k, value in self.staged:
+                values[k] = value
+        self.staged = []
+
+    def prune(self):
+        """
+        Forget objects without sample for twice the heartbeat
+        """
+        oldest = self.latest - 2 * self.heartbeat
+        for dcs_id in [k for k, v in self.written.items() if v[0] < oldest]:
+            del self.written[dcs_id]
+
+
+class DcsIntegerFields(object):
+    """
+    Fields written as InfluxDB integers, by name
+
+    InfluxDB keeps the type of the first value of a field in a shard and
+    the REST server writes integral doubles without fraction, so typing
+    by value would switch a gauge between integer and float. Fields
+    matching patterns but not excluded are integers, all others floats.
+    """
+
+    def __init__(self, patterns, excluded=()):
+        self.patterns = patterns
+        self.excluded = excluded
+        self.names = {}
+
+    def __contains__(self, field):
+        if field not in self.names:
+            self.names[field] = (any(fnmatch.fnmatchcase(field, pattern) for pattern in self.patterns)
+                                 and not any(fnmatch.fnmatchcase(field, pattern) for pattern in self.excluded))
+        return self.names[field]
+
+
+def vsphere_properties(content, vimtype, paths):
+    """
+    Properties of all vCenter objects of a type by managed object id, in
+    a single property collector query
+    """
+    view = content.viewManager.CreateContainerView(content.rootFolder, [vimtype], True)
+    try:
+        traversal = vmodl.query.PropertyCollector.TraversalSpec(name="view", path="view", skip=False,
+                                                                type=vim.view.ContainerView)
+        object_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=view, skip=True, selectSet=[traversal])
+        property_spec = vmodl.query.PropertyCollector.PropertySpec(type=vimtype, pathSet=paths, all=False)
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=[object_spec], propSet=[property_spec])
+        result = content.propertyCollector.RetrieveContents([filter_spec])
+    finally:
+        view.Destroy()
+    return dict((item.obj._moId, dict((prop.name, prop.val) for prop in item.propSet)) for item in result)
+
+
+class DcsVsphere(object):
+    """
+    vSphere datastores and VMs on each DataCore Virtual disk
+
+    The VMFS extents of a datastore name the NAA device of its LUN, which
+    is the ScsiDeviceIdString of the DataCore Virtual disk behind it. The
+    mapping is listed from vCenter every refresh seconds by a background
+    thread, cycles of all targets read the last one without waiting. A
+    failed listing keeps the previous mapping.
+    """
+
+    def __init__(self, vcenter, user, passwd, verify_ssl, refresh, timeout, fields):
+        self.vcenter = vcenter
+        self.user = user
+        self.passwd = passwd
+        self.verify_ssl = verify_ssl
+        self.refresh = refresh
+        self.timeout = timeout
+        self.fields = fields
+        self.mapping = None
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="vsphere")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while True:
             try:
-                if data["__type"] != None:
-                    add_info += ",__type=" + str(data["__type"])
-                    add_info += ",Role=" + str(data["ServerPortProperties"]["Role"])
-            except:
-                logging.info("No __type")
-                
-            add_info += ",PortType=" + str(data["PortType"])
-            
+                self.mapping = self.list()
+                logging.info("vSphere datastores of {} listed: {} DataCore devices".format(
+                    self.vcenter, len(self.mapping)))
+            except Exception as e:
+                logging.error("Can not list vSphere datastores of {}: {}".format(self.vcenter, e))
+            time.sleep(self.refresh)
+
+    def get(self):
+        """
+        NAA device id (lower case, without naa.) -> [(datastore, [vm, ...])],
+        None until vCenter has been listed once
+        """
+        return self.mapping
+
+    def connect(self):
+        kwargs = dict(host=self.vcenter, user=self.user, pwd=self.passwd)
+        if not self.verify_ssl:
+            kwargs["sslContext"] = ssl._create_unverified_context()
+        try:
+            return SmartConnect(httpConnectionTimeout=self.timeout, **kwargs)
+        except TypeError:
+            # Older pyvmomi has no connection timeout, only this thread waits
+            return SmartConnect(**kwargs)
+
+    def list(self):
+        si = self.connect()
+        try:
+            content = si.RetrieveContent()
+            vms = vsphere_properties(content, vim.VirtualMachine, ["name"])
+            datastores = vsphere_properties(content, vim.Datastore, ["name", "info", "vm"])
+        finally:
+            Disconnect(si)
+
+        mapping = {}
+        for props in datastores.values():
+            # NFS, vSAN and vVols datastores have no VMFS extent
+            vmfs = getattr(props.get("info"), "vmfs", None)
+            if vmfs is None:
+                continue
+            names = sorted(vms[vm._moId]["name"] for vm in props.get("vm", []) if vm._moId in vms)
+            for extent in vmfs.extent:
+                device = extent.diskName.lower()
+                if device.startswith("naa."):
+                    mapping.setdefault(device[4:], []).append((props["name"], names))
+        return mapping
+
+    def points(self, mapping, data, tags, fields):
+        """
+        Tags and fields of the DataCore_vSphere points of a Virtual disk,
+        one per VM of each datastore on it
+        """
+        datastores = mapping.get((dcs_str(data.get("ScsiDeviceIdString")) or "").lower())
+        if not datastores:
+            return
+        joined = dict((k, fields[k]) for k in self.fields if k in fields)
+        if not joined:
+            return
+        for datastore, vms in datastores:
+            for vm in vms or ["NA"]:
+                yield tags + [("datastore", datastore), ("vm", vm)], joined
+
+
+class DcsProfiler(object):
+    """
+    cProfile and tracemalloc snapshots of the next cycles of each target
+
+    Once armed (at start with [PROFILE] enabled, or by SIGUSR2), each
+    target profiles its next cycles cycles into directory:
+    <target>-<time>.prof for pstats and, with memory, <target>-<time>.tracemalloc
+    for tracemalloc.Snapshot.load(). Only one cycle is profiled at a time,
+    as Python 3.12 allows a single active profiler per process: cycles of
+    other targets meanwhile run unprofiled and wait for a later cycle.
+    cProfile records the cycle thread, where objects are encoded and
+    written (every thread on Python 3.12 and later), tracemalloc always
+    traces the whole process.
+    """
+
+    def __init__(self, directory, cycles, memory):
+        self.directory = directory
+        self.cycles = cycles
+        self.memory = memory and tracemalloc is not None
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.armed = {}
+        self.remaining = {}
+        self.active = None
+
+    def arm(self):
+        with self.lock:
+            self.generation += 1
+        logging.info("Profiling the next {} cycles of each target into {}".format(self.cycles, self.directory))
+
+    def begin(self, target):
+        """
+        Start profiling a cycle of target, None if it is not profiled
+        """
+        with self.lock:
+            if self.armed.get(target.name, 0) < self.generation:
+                self.armed[target.name] = self.generation
+                self.remaining[target.name] = self.cycles
+            if self.remaining.get(target.name, 0) <= 0 or self.active is not None:
+                return None
+            profile = cProfile.Profile()
             try:
-                add_info += ",PortRole=" + str(data["ServerPortProperties"]["Role"])
-            except:
-                add_info += ",PortRole=" + "N/A"
-
-            add_info += ",Caption=" + str(data["Caption"].encode("ascii","ignore").strip()).replace(" ", "\\ ").replace(",", "\\ ")
-            for k,v in data["Performances"].items():
-                if int(data["Performances"]["CollectionTime"][6:-2])*1000000 < 0:
-                    logging.error("TimeCollection error")
-                    break
-                if "CollectionTime" in k:
-                    continue
-                result.append(line.format(
-                    table,
-                    instance,
-                    objectname,
-                    host,
-                    add_info,
-                    "=".join([str(k), str(v)]),
-                    int(data["Performances"]["CollectionTime"][6:-2])*1000000
-                ))
-        elif "hosts" in data["dcs_resource"]:
-            line = "{},instance={},objectname={},host={}{} {} {}"
-            table = "DataCore_Hosts"
-            objectname = "DataCore\ Hosts"
-            instance = str(data["ExtendedCaption"].encode("ascii","ignore").strip()).replace(" ", "\\ ").replace(",", "\\ ")
-            host = str(data["Caption"].encode("ascii","ignore").strip()).replace(" ", "\\ ").replace(",", "\\ ")
-            # Add specific info
-            add_info = ",id=" + str(data["Id"])
-            add_info += ",MpioCapable=" + str(data["MpioCapable"])
-            add_info += ",AluaSupport=" + str(data["AluaSupport"])
-            for k,v in data["Performances"].items():
-                if int(data["Performances"]["CollectionTime"][6:-2])*1000000 < 0:
-                    logging.error("TimeCollection error")
-                    break
-                if "CollectionTime" in k:
-                    continue
-                result.append(line.format(
-                    table,
-                    instance,
-                    objectname,
-                    host,
-                    add_info,
-                    "=".join([str(k), str(v)]),
-                    int(data["Performances"]["CollectionTime"][6:-2])*1000000
-                ))
-            result.append(line.format(
-                table,
-                instance,
-                objectname,
-                host,
-                add_info,
-                "=".join(["State", str(data["State"])]),
-                int(data["Performances"]["CollectionTime"][6:-2])*1000000
-             ))
+                profile.enable()
+            except ValueError as e:
+                # Another profiling tool is active (Python 3.12 and later)
+                logging.warning("Can not profile cycle of {}: {}".format(target.name, e))
+                return None
+            self.active = target.name
+            self.remaining[target.name] -= 1
+            if self.memory:
+                tracemalloc.start(25)
+        return profile
+
+    def end(self, target, profile):
+        profile.disable()
+        now = time.time()
+        path = os.path.join(self.directory, "{}-{}{:03d}".format(re.sub(r'[^A-Za-z0-9_.-]', '_', target.name),
+                                                                 time.strftime("%Y%m%d-%H%M%S", time.localtime(now)),
+                                                                 int(now * 1000) % 1000))
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            # Before dump_stats, whose own allocations would top the snapshot
+            if self.memory:
+                tracemalloc.take_snapshot().dump(path + ".tracemalloc")
+            profile.dump_stats(path + ".prof")
+            logging.info("Cycle profile of {} written to {}.prof".format(target.name, path))
+        except (IOError, OSError) as e:
+            logging.error("Can not write cycle profile of {}: {}".format(target.name, e))
+        finally:
+            with self.lock:
+                if self.memory:
+                    tracemalloc.stop()
+                self.active = None
+
+
+class DcsTarget(object):
+    """
+    A DataCore server group and its collection state
+
+    Each target has its own REST client, inventory, rates, states and Id
+    indexes, so targets are collected in parallel and only share the
+    InfluxDB writer. group tags the points, empty for a [SERVERS] only
+    config.
+    """
+
+    def __init__(self, group, rest_server, datacore_server, user, passwd):
+        self.group = group
+        self.name = group or datacore_server
+        self.datacore_server = datacore_server
+        self.url = "http://{}/RestService/rest.svc/1.0".format(rest_server)
+        self.headers = {'ServerHost': datacore_server,
+                        'Authorization': 'Basic {} {}'.format(user, passwd)}
+        self.client = None
+        self.inventory = None
+        self.rates = None
+        self.states = None
+        self.servers = {}
+        self.servers_hosts = {}
+        self.exporter = None
+        self.vsphere = None
+        self.profiler = None
+
+    def open(self, rates=False):
+        """
+        Create the REST client, inventory and, if rates, the rates and
+        states trackers kept between cycles
+        """
+        self.client = dcs_rest_client(self.url, self.headers)
+        self.inventory = dcs_inventory(self.client)
+        if rates:
+            self.rates = dcs_rates()
+            self.states = dcs_states()
+        return self
+
+    def shard(self, shards):
+        """
+        Shard of the target, stable across collectors and restarts
+        """
+        return (zlib.crc32(self.name.encode('utf-8')) & 0xffffffff) % shards
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+
+
+class DcsCycleStats(object):
+    """
+    Timings and counters of a collection cycle, written as DataCore_Collector
+
+    Stages overlap: <stage>_seconds is the time spent in the stage, except
+    inventory_seconds and perf_seconds, elapsed until the stage completed.
+    """
+
+    def __init__(self, interval=None, target=None):
+        self.start = time.time()
+        self.target = target
+        self.fields = dict((name, 0) for name in ("cycle_errors", "perf_errors", "unknown_ids",
+                                                  "points", "bytes", "sent_bytes", "spooled_points",
+                                                  "suppressed_fields"))
+        if interval:
+            self.fields["interval_seconds"] = float(interval)
+
+    def count(self, name, value=1):
+        self.fields[name] = self.fields.get(name, 0) + value
+
+    def latencies(self, latencies):
+        """
+        Count and distribution of REST requests latencies
+        """
+        latencies = sorted(latencies)
+        self.count("rest_requests", len(latencies))
+        if not latencies:
+            return
+        for name, rank in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99)):
+            self.fields["rest_{}_seconds".format(name)] = latencies[min(int(len(latencies) * rank),
+                                                                      len(latencies) - 1)]
+        self.fields["rest_max_seconds"] = latencies[-1]
+
+    def to_line(self):
+        tags = [("instance", self.target.datacore_server if self.target else ''),
+                ("group", self.target.group if self.target else ''),
+                ("host", socket.gethostname())]
+        if config.getboolean('INFLUXDB', 'integer_fields', fallback=True):
+            integer_fields = DcsIntegerFields(["*"], ["*_seconds"])
         else:
-            logging.error("This resource ({}) is not yet implemented".format(resource))
-    
-    # Post in influxdb
-    logging.info("Post data in influxdb")         
-    data = "\n".join(result)
-    req = requests.post(url_influxdb, data.encode('utf-8'))
-    if req.status_code >= 200 and req.status_code < 300:
-        logging.info("Done!")
-    else:
-        logging.error("A problem occurs... Response code was {}".format(req.status_code))
-        logging.error(req.text)
+            integer_fields = DcsIntegerFields([])
+        return lp_line("DataCore_Collector", tags, self.fields, int(self.start * 1e9), integer_fields)
 
 
+# Prometheus metric prefix of each perf measurement, and label of each tag
+PROM_PREFIXES = {
+    "DataCore_Servers": "datacore_server",
+    "DataCore_Disk_pools": "datacore_pool",
+    "DataCore_Virtual_Disks": "datacore_virtual_disk",
+    "DataCore_Physical_disk": "datacore_physical_disk",
+    "DataCore_SCSI_ports": "datacore_port",
+    "DataCore_Hosts": "datacore_host",
+    "DataCore_Collector": "datacore_collector",
+}
+# instance is set by Prometheus to the scrape target
+PROM_LABELS = {"instance": "name", "host": "host", "id": "id", "group": "group",
+               "Type": "type", "PortRole": "port_role"}
+PROM_COLLECTOR_LABELS = {"instance": "datacore_server", "group": "group"}
 
 
-if __name__ == "__main__":
-    
-    dcs_servers = {}
+def prom_escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
 
-    dcs_servers = dcs_get_object("servers")
 
-    dcs_servers_hosts = dcs_servers + dcs_get_object("hosts")
-    resources = [r for r in config['RESOURCES'] if config['RESOURCES'].getboolean(r)]
-    
-    dcs_objects = []
-    for resource in resources:
-        dcs_objects += dcs_get_object(resource)
-    
-    dcs_perfs = dcs_get_perf(dcs_objects)
+def prom_value(value):
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+
+def prom_labels(tags, labels):
+    """
+    Prometheus label set of point tags, only tags listed in labels are kept
+    """
+    return ",".join('{}="{}"'.format(labels[key], prom_escape(value))
+                    for key, value in tags if value and key in labels)
+
+
+class DcsExporter(object):
+    """
+    Prometheus /metrics of the latest perf snapshot of every target
+
+    Cycles publish their points, the exposition is rendered once on the
+    first scrape after a publish and then served from cache, so scrapes
+    never query the REST server. Labels are the identity tags of the
+    points, series are bounded by the number of objects, and objects not
+    polled for max_age seconds are dropped. Counters are the cumulative
+    counters matching patterns, other fields are gauges; _rate fields are
+    left to rate().
+    """
+
+    def __init__(self, patterns, max_age):
+        self.patterns = patterns
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.points = {}
+        self.stats = {}
+        self.names = {}
+        self.body = None
+        self.compressed = None
+        self.server = None
+
+    def publish(self, target, snapshot):
+        """
+        Replace the points of the objects polled by a cycle of target
+        """
+        now = time.time()
+        with self.lock:
+            for (measurement, dcs_id), (tags, fields) in snapshot.items():
+                self.points[(target.name, measurement, dcs_id)] = (now, measurement, tags, fields)
+            oldest = now - self.max_age
+            for key in [k for k, v in self.points.items() if v[0] < oldest]:
+                del self.points[key]
+            self.body = None
+
+    def publish_stats(self, stats):
+        with self.lock:
+            self.stats[stats.target.name] = ([("instance", stats.target.datacore_server),
+                                              ("group", stats.target.group)], dict(stats.fields))
+            self.body = None
+
+    def metric(self, prefix, field, counters):
+        """
+        Metric name and type of a field
+        """
+        key = (prefix, field)
+        if key not in self.names:
+            name = "{}_{}".format(prefix, re.sub(r'[^a-z0-9_]', '_',
+                                                 re.sub(r'(?<=[a-z0-9])(?=[A-Z])', '_', field).lower()))
+            if counters and any(fnmatch.fnmatchcase(field, pattern) for pattern in self.patterns):
+                self.names[key] = (name + "_total", "counter")
+            else:
+                self.names[key] = (name, "gauge")
+        return self.names[key]
+
+    def render(self):
+        families = {}
+
+        def add(prefix, labels, fields, counters):
+            for field, value in fields.items():
+                if isinstance(value, DCS_TEXT_TYPES) or value is None or field.endswith("_rate"):
+                    continue
+                name, kind = self.metric(prefix, field, counters)
+                families.setdefault(name, (kind, []))[1].append(
+                    "{}{{{}}} {}".format(name, labels, prom_value(value)))
+
+        for seen, measurement, tags, fields in self.points.values():
+            add(PROM_PREFIXES[measurement], prom_labels(tags, PROM_LABELS), fields, True)
+        for tags, fields in self.stats.values():
+            add(PROM_PREFIXES["DataCore_Collector"], prom_labels(tags, PROM_COLLECTOR_LABELS), fields, False)
+
+        lines = []
+        for name in sorted(families):
+            kind, samples = families[name]
+            lines.append("# TYPE {} {}".format(name, kind))
+            lines.extend(samples)
+        return ("\n".join(lines) + "\n").encode('utf-8')
+
+    def metrics(self, compressed=False):
+        """
+        Exposition body, gzip compressed if compressed
+        """
+        with self.lock:
+            if self.body is None:
+                start = time.time()
+                self.body = self.render()
+                self.compressed = None
+                logging.info("Rendered {} bytes of metrics in {:.3f}s".format(len(self.body), time.time() - start))
+            if not compressed:
+                return self.body
+            if self.compressed is None:
+                self.compressed = gzip_compress(self.body)
+            return self.compressed
+
+    def serve(self, address):
+        """
+        Serve /metrics on address (host, port) from a background thread
+        """
+        self.server = DcsMetricsServer(address, self)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        logging.info("Serving /metrics on {}:{}".format(*self.server.server_address[:2]))
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
 
-    put_in_influxdb(dcs_perfs)
-  
+
+class DcsMetricsHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        compressed = "gzip" in self.headers.get("Accept-Encoding", "")
+        body = self.server.exporter.metrics(compressed)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        if compressed:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class DcsMetricsServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, exporter):
+        HTTPServer.__init__(self, address, DcsMetricsHandler)
+        self.exporter = exporter
+
+
+# exceptions
+
+class DcsError(Exception):
+    """
+    Error while querying the DataCore REST server
+    """
+
+
+class DcsUnknownId(DcsError):
+    """
+    DataCore Object Id unknown by the REST server
+    """
+
+
+# fuctions
+
+def gzip_compress(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def print_cool(msg):
+    msg = "  " + msg + "  "
+    print("".center(80,"#"))
+    print(msg.center(80,"#"))
+    print("".center(80,"#"))
+    print("\n")
+
+def dcs_monitorid_to_str(i):
+    """
+    Helper that convert a monitor state int to a str.
+    """
+    if i == 1:
+        return "Undefined"
+    elif i == 2:
+        return "Healthy"
+    elif i == 4:
+        return "Attention"
+    elif i == 8:
+        return "Warning"
+    elif i == 16:
+        return "Critical"
+    else:
+        return "Undefined"
+
+
+
+def dcs_targets(shard=None, shards=None):
+    """
+    Targets of this collector from config
+
+    One target per [TARGET:<group>] section, user and passwd default to
+    [CREDENTIALS]. Without such section, [SERVERS] is the only target.
+    With more than one shard, only targets hashed to shard are kept.
+    """
+    targets = []
+    for section in config.sections():
+        if not section.startswith('TARGET:'):
+            continue
+        targets.append(DcsTarget(section[len('TARGET:'):].strip(),
+                                 config.get(section, 'rest_server'),
+                                 config.get(section, 'datacore_server'),
+                                 config.get(section, 'user', fallback=config.get('CREDENTIALS', 'user')),
+                                 config.get(section, 'passwd', fallback=config.get('CREDENTIALS', 'passwd'))))
+    if not targets:
+        targets.append(DcsTarget(config.get('SERVERS', 'group', fallback=''),
+                                 config['SERVERS']['rest_server'],
+                                 config['SERVERS']['datacore_server'],
+                                 config['CREDENTIALS']['user'],
+                                 config['CREDENTIALS']['passwd']))
+
+    if shards is None:
+        shards = config.getint('COLLECTOR', 'shards', fallback=1)
+        shard = config.getint('COLLECTOR', 'shard', fallback=0)
+    if shards > 1:
+        targets = [target for target in targets if target.shard(shards) == shard]
+        logging.info("Shard {}/{}: {}".format(shard, shards,
+                                              ", ".join(target.name for target in targets) or "no target"))
+    return targets
+
+
+def dcs_rest_client(url, headers):
+    """
+    Create a REST client from config
+    """
+    max_inflight = config.getint('COLLECTOR', 'max_inflight', fallback=16)
+    concurrency = DcsConcurrency(config.getint('COLLECTOR', 'min_inflight', fallback=2),
+                                 max_inflight,
+                                 config.getfloat('COLLECTOR', 'latency_target', fallback=1),
+                                 config.getfloat('COLLECTOR', 'error_rate', fallback=0.05))
+    return DcsRestClient(url, headers, max_inflight,
+                         (config.getfloat('COLLECTOR', 'connect_timeout', fallback=5),
+                          config.getfloat('COLLECTOR', 'read_timeout', fallback=30)),
+                         concurrency)
+
+
+def dcs_inventory(client):
+    """
+    Create the inventory cache from config
+    """
+    refresh_resources = {}
+    if config.has_section('INVENTORY'):
+        for resource in config['INVENTORY']:
+            if resource != 'refresh':
+                refresh_resources[resource] = config.getfloat('INVENTORY', resource)
+    return DcsInventory(client,
+                        config.getfloat('INVENTORY', 'refresh', fallback=300),
+                        refresh_resources)
+
+
+def dcs_rates():
+    """
+    Create the rates tracker from config, None if disabled. max_gap is
+    raised to twice the longest polling interval, so slow resources
+    still get rates.
+    """
+    if not config.getboolean('RATES', 'enabled', fallback=True):
+        return None
+    patterns = config.get('RATES', 'counters',
+                          fallback='Total*, Target*, Initiator*, FrontEnd*, BackEnd*, Cache*Hits, Cache*Misses')
+    max_gap = config.getfloat('RATES', 'max_gap', fallback=300)
+    interval = config.getint('COLLECTOR', 'interval', fallback=10)
+    longest = max([interval] + list(dcs_resource_intervals(interval).values()))
+    if max_gap < 2 * longest:
+        logging.warning("[RATES] max_gap {}s is below twice the {}s polling interval, using {}s".format(
+            max_gap, longest, 2 * longest))
+        max_gap = 2 * longest
+    return DcsRates([pattern.strip() for pattern in patterns.split(',') if pattern.strip()], max_gap)
+
+
+def dcs_states():
+    """
+    Create the state fields tracker from config, None if disabled
+    """
+    if not config.getboolean('STATES', 'enabled', fallback=True):
+        return None
+    fields = config.get('STATES', 'fields',
+                        fallback='State, CacheState, PowerState, PoolStatus, TierReservedPct, ChunkSize, '
+                                 'MaxTierNumber, DiskStatus, Size')
+    return DcsStates([field.strip() for field in fields.split(',') if field.strip()],
+                     config.getfloat('STATES', 'heartbeat', fallback=300))
+
+
+def dcs_integer_fields():
+    """
+    Create the integer fields of DataCore points from config, none with
+    integer_fields off. Rates and percentages are always floats.
+    """
+    if not config.getboolean('INFLUXDB', 'integer_fields', fallback=True):
+        return DcsIntegerFields([])
+    names = config.get('INFLUXDB', 'integer_names',
+                       fallback='Total*, Target*, Initiator*, FrontEnd*, BackEnd*, Cache*Hits, Cache*Misses, '
+                                'Bytes*, State, CacheState, PowerState, PoolStatus, DiskStatus, Size, '
+                                'ChunkSize, MaxTierNumber')
+    return DcsIntegerFields([name.strip() for name in names.split(',') if name.strip()],
+                            ["*_rate", "*Percent*", "*Pct"])
+
+
+def dcs_vsphere():
+    """
+    Create the vSphere mapping from config, None if disabled. It is
+    listed again with the inventory, unless [VSPHERE] refresh is set.
+    Listing starts right away, alongside the first cycles.
+    """
+    if not config.getboolean('VSPHERE', 'enabled', fallback=False):
+        return None
+    if vim is None:
+        msg_error_import("pyvmomi")
+    fields = config.get('VSPHERE', 'fields',
+                        fallback='TotalReads_rate, TotalWrites_rate, TotalReadTime_rate, TotalWriteTime_rate, '
+                                 'TotalBytesRead_rate, TotalBytesWritten_rate')
+    vsphere = DcsVsphere(config.get('VSPHERE', 'vcenter'),
+                         config.get('VSPHERE', 'user'),
+                         config.get('VSPHERE', 'passwd'),
+                         config.getboolean('VSPHERE', 'verify_ssl', fallback=False),
+                         config.getfloat('VSPHERE', 'refresh',
+                                         fallback=config.getfloat('INVENTORY', 'refresh', fallback=300)),
+                         config.getfloat('VSPHERE', 'timeout', fallback=30),
+                         [field.strip() for field in fields.split(',') if field.strip()])
+    vsphere.start()
+    return vsphere
+
+
+def dcs_profiler():
+    """
+    Create the cycle profiler from config, armed if [PROFILE] enabled
+    """
+    profiler = DcsProfiler(config.get('PROFILE', 'directory', fallback='/var/lib/datacore/profile'),
+                           config.getint('PROFILE', 'cycles', fallback=3),
+                           config.getboolean('PROFILE', 'memory', fallback=True))
+    if config.getboolean('PROFILE', 'enabled', fallback=False):
+        profiler.arm()
+    return profiler
+
+
+def influx_spool():
+    """
+    Create the spool from config, None if disabled
+    """
+    if not config.getboolean('SPOOL', 'enabled', fallback=False):
+        return None
+    return InfluxSpool(config.get('SPOOL', 'directory', fallback='/var/lib/datacore/spool'),
+                       config.getint('SPOOL', 'max_bytes', fallback=268435456))
+
+
+def dcs_exporter(intervals, enabled=False):
+    """
+    Create the Prometheus exporter from config and serve it, None if
+    disabled. Objects are dropped after twice their longest interval.
+    """
+    if not enabled and not config.getboolean('PROMETHEUS', 'enabled', fallback=False):
+        return None
+    interval = config.getint('COLLECTOR', 'interval', fallback=10)
+    patterns = config.get('RATES', 'counters',
+                          fallback='Total*, Target*, Initiator*, FrontEnd*, BackEnd*, Cache*Hits, Cache*Misses')
+    exporter = DcsExporter([pattern.strip() for pattern in patterns.split(',') if pattern.strip()],
+                           2 * max([interval] + list(intervals.values())))
+    host, port = config.get('PROMETHEUS', 'listen', fallback='0.0.0.0:9610').rsplit(':', 1)
+    exporter.serve((host, int(port)))
+    return exporter
+
+
+def influx_writer():
+    """
+    Create the InfluxDB writer from config
+    """
+    return InfluxWriter(url_influxdb,
+                        config.getint('INFLUXDB', 'batch_points', fallback=5000),
+                        config.getint('INFLUXDB', 'batch_bytes', fallback=4194304),
+                        config.getboolean('INFLUXDB', 'gzip', fallback=True),
+                        config.getint('INFLUXDB', 'retries', fallback=3),
+                        config.getfloat('INFLUXDB', 'retry_backoff', fallback=0.5),
+                        config.getfloat('INFLUXDB', 'timeout', fallback=10),
+                        influx_spool())
+
+
+def dcs_iter_json_array(chunks):
+    """
+    Yield the items of a JSON array one by one from chunks of bytes
+
+    Each item is decoded once it is complete, so only one item and one
+    chunk are in memory. A top-level object (REST error) is yielded whole.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    pos = 0
+    in_array = None
+    for chunk in itertools.chain(chunks, [None]):
+        last = chunk is None
+        buffer = buffer[pos:] + utf8.decode(chunk or b"", final=last)
+        pos = 0
+        if in_array is None:
+            stripped = buffer.lstrip()
+            if not stripped:
+                continue
+            if not stripped.startswith("["):
+                # Not an array, wait for the whole document
+                if last:
+                    yield json.loads(buffer)
+                    return
+                continue
+            pos = len(buffer) - len(stripped) + 1
+            in_array = True
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == "]":
+                return
+            if pos >= len(buffer):
+                break
+            try:
+                item, pos = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                if last:
+                    raise
+                # Incomplete item, wait for the next chunk
+                break
+            yield item
+    if in_array:
+        raise ValueError("Truncated JSON array")
+
+
+def dcs_get_object(client, dcs_object):
+    """
+    Get DataCore Object (ex: servers, virtualdisks...)
+
+    The response is parsed item by item and only kept as DcsObject.
+    """
+    logging.info('Begin to query the REST server at {}'.format(client.url))
+    
+    try:
+        r = client.get(dcs_object, stream=True)
+    except:
+        raise DcsError("Something wrong during connection")
+    logging.info("Querying {}".format(dcs_object))
+    result = []
+    try:
+        for item in dcs_iter_json_array(r.iter_content(65536)):
+            if "ErrorCode" in item:
+                raise DcsError(item["Message"])
+            if dcs_object == "servers":
+                if str(item["RegionNodeId"]) == "None":
+                    logging.warning("Exception: Partner server: " +item["Caption"])
+                    continue
+            elif dcs_object == "ports":
+                if "Microsoft iSCSI" in item["Caption"] or "Loop" in item["Caption"]:
+                    continue
+            elif dcs_object == "physicaldisks":
+                if item["Type"] != 4:
+                    continue
+            result.append(DcsObject.from_json(item, dcs_object))
+    except DcsError:
+        raise
+    except Exception as e:
+        raise DcsError("Invalid {} response: {}".format(dcs_object, e))
+    finally:
+        r.close()
+    return result
+
+
+
+def dcs_request_perf(client, dcs_id):
+    """
+    Get performances of a DataCore Object from its Id, None on error
+
+    Latency and failures are accounted in client.concurrency.
+    """
+    start = time.time()
+    failed = True
+    try:
+        res = client.get('performance/{}'.format(dcs_id))
+        if res.status_code == 404:
+            raise DcsUnknownId(dcs_id)
+        res.raise_for_status()
+        perf = res.json()
+        failed = False
+    except DcsUnknownId:
+        failed = False
+        raise
+    except Exception as e:
+        logging.warning("Perf query failed for {}: {}".format(dcs_id, e))
+        return None
+    finally:
+        client.concurrency.observe(time.time() - start, failed)
+    if not perf or "ErrorCode" in perf:
+        raise DcsUnknownId(dcs_id)
+    return perf[0]
+
+# Units of [RESOURCES] intervals
+DCS_INTERVAL_UNITS = {"s": 1, "m": 60, "h": 3600}
+
+
+def dcs_resource_intervals(interval):
+    """
+    Polling interval of each enabled resource from [RESOURCES]
+
+    A resource is set to yes/no or to its own interval (ex: 60s, 5m, 1h),
+    rounded to a multiple of the collector interval.
+    """
+    intervals = {}
+    for resource in config['RESOURCES']:
+        value = config['RESOURCES'][resource].strip().lower()
+        if value in config.BOOLEAN_STATES:
+            if config.BOOLEAN_STATES[value]:
+                intervals[resource] = interval
+            continue
+        unit = DCS_INTERVAL_UNITS.get(value[-1:])
+        try:
+            seconds = float(value[:-1] if unit else value) * (unit or 1)
+        except ValueError:
+            raise DcsError("Invalid interval for {}: {}".format(resource, value))
+        intervals[resource] = max(int(round(seconds / interval)), 1) * interval
+    return intervals
+
+
+def dcs_polled(dcs_object, slots, tick):
+    """
+    Whether a DataCore Object is polled at tick
+
+    Objects of a resource polled every slots ticks are spread over the
+    slots by a hash of their Id, so its requests are spread over its
+    interval instead of all sent in one cycle.
+    """
+    if slots <= 1:
+        return True
+    return (zlib.crc32(dcs_object["Id"].encode('utf-8')) & 0xffffffff) % slots == tick % slots
+
+
+def dcs_list(inventory, resource):
+    """
+    List a resource through the inventory, return objects and duration
+    """
+    start = time.time()
+    return inventory.get(resource), time.time() - start
+
+
+def dcs_iter_perf(target, resources, tick, listed, stats):
+    """
+    Yield DataCore Objects with their performances as soon as they are fetched
+
+    All resources are listed concurrently and the perf requests of a
+    resource are queued as soon as its list arrives, for its objects polled
+    at tick (resources maps a resource to its slots, see dcs_polled).
+    Perf requests in flight are bounded by the concurrency limit of the
+    client, and at most 4 times max_inflight results are pending, so memory
+    does not grow with the number of objects. Objects are only yielded once
+    servers and hosts are indexed in target, the encoding needs them.
+    Objects of a resource listed again are added to listed, for
+    DataCore_Inventory.
+    """
+    client = target.client
+    inventory = target.inventory
+    done = queue.Queue()
+    window = 4 * client.max_inflight
+
+    def submit(kind, item, fn, *args):
+        future = client.executor.submit(fn, *args)
+        future.add_done_callback(lambda future: done.put((kind, item, future)))
+
+    listing = set(resources) | set(["servers", "hosts"])
+    for resource in listing:
+        submit("list", resource, dcs_list, inventory, resource)
+
+    todo = collections.deque()
+    held = []
+    inflight = 0
+    indexed = False
+    while True:
+        while todo and inflight < client.concurrency.limit and inflight + len(held) < window:
+            dcs_object = todo.popleft()
+            submit("perf", dcs_object, dcs_request_perf, client, dcs_object["Id"])
+            inflight += 1
+        if not listing and not inflight:
+            break
+
+        kind, item, future = done.get()
+        if kind == "list":
+            listing.discard(item)
+            objects, seconds = future.result()
+            stats.count("inventory_{}_seconds".format(item), seconds)
+            if item in resources:
+                stats.count("objects_{}".format(item), len(objects))
+                polled = [dcs_object for dcs_object in objects if dcs_polled(dcs_object, resources[item], tick)]
+                stats.count("polled_{}".format(item), len(polled))
+                todo.extend(polled)
+                if inventory.listed(item):
+                    listed.extend(objects)
+            if not indexed and "servers" not in listing and "hosts" not in listing:
+                target.servers = inventory.index("servers")
+                target.servers_hosts = inventory.index("servers", "hosts")
+                indexed = True
+                for dcs_perf in held:
+                    yield dcs_perf
+                held = []
+            if not listing:
+                stats.fields["inventory_seconds"] = time.time() - stats.start
+            continue
+
+        inflight -= 1
+        try:
+            perf = future.result()
+        except DcsUnknownId:
+            logging.warning("Unknown Id {} in {}".format(item["Id"], item["dcs_resource"]))
+            inventory.invalidate(item["dcs_resource"])
+            stats.count("unknown_ids")
+            continue
+        if perf is None:
+            stats.count("perf_errors")
+            continue
+        # Cached inventory objects are not modified
+        dcs_perf = item.copy()
+        dcs_perf["Performances"] = perf
+        if indexed:
+            yield dcs_perf
+        else:
+            held.append(dcs_perf)
+    stats.fields["perf_seconds"] = time.time() - stats.start
+
+
+def dcs_caption_from_id(dcs_id,dcs_index):
+    """
+    Find Caption from an DataCore Id in an Id -> object index
+    """ 
+    item = dcs_index.get(dcs_id)
+    if item is not None:
+        return dcs_str(item["Caption"])
+
+
+
+
+
+# Measurement and objectname tag of each resource
+DCS_MEASUREMENTS = {
+    "servers": ("DataCore_Servers", "DataCore Servers"),
+    "pools": ("DataCore_Disk_pools", "DataCore Disk pools"),
+    "virtualdisks": ("DataCore_Virtual_Disks", "DataCore Virtual disks"),
+    "physicaldisks": ("DataCore_Physical_disk", "DataCore Physical disk"),
+    "ports": ("DataCore_SCSI_ports", "DataCore SCSI ports"),
+    "hosts": ("DataCore_Hosts", "DataCore Hosts"),
+}
+
+
+def dcs_str(value):
+    """
+    ASCII text of a DataCore value, None stays None
+    """
+    if value is None:
+        return None
+    return "{}".format(value).encode("ascii","ignore").decode("ascii").strip()
+
+
+def dcs_timestamp(perf):
+    """
+    CollectionTime ("/Date(1584031831349)/") in nanoseconds, None if invalid
+    """
+    match = re.match(r"/Date\((-?\d+)", perf.get("CollectionTime") or "")
+    if match is None or int(match.group(1)) < 0:
+        return None
+    return int(match.group(1)) * 1000000
+
+
+def lp_escape_measurement(value):
+    return value.replace(",", "\\,").replace(" ", "\\ ")
+
+
+def lp_escape_tag(value):
+    return (value.replace("\\", "\\\\").replace(",", "\\,").replace("=", "\\=")
+            .replace(" ", "\\ ").replace("\n", "\\n"))
+
+
+def lp_field_value(value, integer=False):
+    """
+    Line protocol field value, an integer or a float for numbers whatever
+    their JSON type, None if the value can not be written
+    """
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, DCS_INTEGER_TYPES + (float,)):
+        if isinstance(value, float) and (math.isnan(value) or math.isinf(value)):
+            return None
+        return "{}i".format(int(round(value))) if integer else repr(float(value))
+    if isinstance(value, DCS_TEXT_TYPES):
+        return '"{}"'.format(value.replace("\\", "\\\\").replace('"', '\\"'))
+    return None
+
+
+def lp_line(measurement, tags, fields, timestamp, integer_fields=()):
+    """
+    Encode a point in InfluxDB line protocol, None if it has no field.
+    Numbers are floats unless their field is in integer_fields.
+    """
+    line = [lp_escape_measurement(measurement)]
+    for key, value in tags:
+        if value:
+            line.append(",{}={}".format(lp_escape_tag(key), lp_escape_tag(value)))
+    separator = " "
+    for key, value in fields.items():
+        value = lp_field_value(value, key in integer_fields)
+        if value is not None:
+            line.append("{}{}={}".format(separator, lp_escape_tag(key), value))
+            separator = ","
+    if separator == " ":
+        return None
+    line.append(" {}".format(timestamp))
+    return "".join(line)
+
+
+def dcs_servers_info(data, target):
+    """
+    Host, type tags, state fields and attributes of a DataCore Server
+    """
+    fields = {"State": data["State"],
+              "CacheState": data["CacheState"],
+              "PowerState": data["PowerState"]}
+    attributes = {"OsVersion": dcs_str(data["OsVersion"]),
+                  "ProductBuild": dcs_str(data["ProductBuild"]),
+                  "ProductVersion": dcs_str(data["ProductVersion"]),
+                  "ProductName": dcs_str(data["ProductName"]),
+                  "ProductType": dcs_str(data["ProductType"])}
+    return dcs_str(data["Caption"]), [], fields, attributes
+
+
+def dcs_pools_info(data, target):
+    """
+    Host, type tags, state fields and attributes of a DataCore Disk pool
+    """
+    fields = {"PoolStatus": data["PoolStatus"],
+              "TierReservedPct": data["TierReservedPct"],
+              "ChunkSize": data["ChunkSize"]["Value"],
+              "MaxTierNumber": data["MaxTierNumber"]}
+    attributes = {"InSharedMode": dcs_str(data["InSharedMode"]),
+                  "AutoTieringEnabled": dcs_str(data["AutoTieringEnabled"])}
+    return dcs_caption_from_id(data["ServerId"],target.servers), [], fields, attributes
+
+
+def dcs_virtualdisks_info(data, target):
+    """
+    Host, type tags, state fields and attributes of a DataCore Virtual disk
+    """
+    tags = [("Type", dcs_str(data["Type"]))]
+    fields = {"DiskStatus": data["DiskStatus"],
+              "Size": data["Size"]["Value"]}
+    attributes = {"ScsiDeviceIdString": dcs_str(data["ScsiDeviceIdString"])}
+    if data["FirstHostId"] != None:
+        attributes["FirstHost"] = dcs_caption_from_id(data["FirstHostId"],target.servers)
+    if data["SecondHostId"] != None:
+        attributes["SecondHost"] = dcs_caption_from_id(data["SecondHostId"],target.servers)
+    return "NA", tags, fields, attributes
+
+
+def dcs_physicaldisks_info(data, target):
+    """
+    Host, type tags, state fields and attributes of a DataCore Physical disk
+    """
+    tags = [("Type", dcs_str(data["Type"]))]
+    fields = {"DiskStatus": data["DiskStatus"]}
+    attributes = {"Serial": dcs_str(data["InquiryData"]["Serial"]) or "UNKNOWN"}
+    return dcs_caption_from_id(data["HostId"],target.servers_hosts), tags, fields, attributes
+
+
+def dcs_ports_info(data, target):
+    """
+    Host, type tags, state fields and attributes of a DataCore SCSI port
+    """
+    role = (data.get("ServerPortProperties") or {}).get("Role")
+    tags = [("PortRole", dcs_str(role) or "N/A")]
+    attributes = {"PortType": dcs_str(data["PortType"])}
+    if data.get("__type") != None:
+        attributes["__type"] = dcs_str(data["__type"])
+    host = None
+    if data["HostId"] != None:
+        host = dcs_caption_from_id(data["HostId"],target.servers_hosts)
+    return host, tags, {}, attributes
+
+
+def dcs_hosts_info(data, target):
+    """
+    Host, type tags, state fields and attributes of a DataCore Host
+    """
+    fields = {"State": data["State"]}
+    attributes = {"MpioCapable": dcs_str(data["MpioCapable"]),
+                  "AluaSupport": dcs_str(data["AluaSupport"])}
+    return dcs_str(data["Caption"]), [], fields, attributes
+
+
+DCS_INFOS = {
+    "servers": dcs_servers_info,
+    "pools": dcs_pools_info,
+    "virtualdisks": dcs_virtualdisks_info,
+    "physicaldisks": dcs_physicaldisks_info,
+    "ports": dcs_ports_info,
+    "hosts": dcs_hosts_info,
+}
+
+
+def dcs_base_tags(data, objectname, host, group):
+    """
+    Identity tags shared by perf and inventory points, group is left out
+    when empty
+    """
+    return [("instance", dcs_str(data["ExtendedCaption"])),
+            ("objectname", objectname),
+            ("host", host or "NA"),
+            ("id", dcs_str(data["Id"])),
+            ("group", group)]
+
+
+def dcs_to_points(datas, target, rates=None):
+    """
+    One point (measurement, tags, fields, timestamp) per DataCore Object
+    of a target
+    """
+    for data in datas:
+        resource = data["dcs_resource"]
+        if resource not in DCS_INFOS:
+            logging.error("This resource ({}) is not yet implemented".format(resource))
+            continue
+        if resource == "virtualdisks" and data["StorageProfileId"] == None:
+            continue
+        timestamp = dcs_timestamp(data["Performances"])
+        if timestamp is None:
+            logging.error("TimeCollection error for {}".format(data["Id"]))
+            continue
+
+        measurement, objectname = DCS_MEASUREMENTS[resource]
+        host, add_tags, add_fields, attributes = DCS_INFOS[resource](data, target)
+        tags = dcs_base_tags(data, objectname, host, target.group) + add_tags
+
+        fields = dict((k, v) for k, v in data["Performances"].items() if k != "CollectionTime")
+        fields.update(add_fields)
+        if rates is not None:
+            rates.add_rates(data["Id"], fields, timestamp)
+        yield measurement, tags, fields, timestamp
+
+
+def dcs_iter_lines(datas, target, rates=None, stats=None, snapshot=None):
+    """
+    Encode DataCore Objects performances in InfluxDB line protocol, one
+    object at a time as datas are consumed, timed and sized by resource
+    in stats. Points are also kept in
+    snapshot, if any, by measurement and Id, with all their state fields
+    even those left out of the lines by the target states tracker. Virtual
+    disks behind vSphere datastores also get their DataCore_vSphere points.
+    """
+    integer_fields = dcs_integer_fields()
+    states = target.states
+    vsphere = target.vsphere
+    mapping = vsphere.get() if vsphere is not None else None
+    for data in datas:
+        start = time.time()
+        resource = data["dcs_resource"]
+        lines = []
+        for measurement, tags, fields, timestamp in dcs_to_points([data], target, rates):
+            if snapshot is not None:
+                snapshot[(measurement, data["Id"])] = (tags, fields)
+            if mapping and resource == "virtualdisks":
+                for vsphere_tags, vsphere_fields in vsphere.points(mapping, data, tags, fields):
+                    lines.append(lp_line("DataCore_vSphere", vsphere_tags, vsphere_fields, timestamp,
+                                         integer_fields))
+                    if stats is not None:
+                        stats.count("vsphere_points")
+            if states is not None:
+                fields, unchanged = states.changed(data["Id"], fields, timestamp)
+                if stats is not None and unchanged:
+                    stats.count("suppressed_fields", unchanged)
+            lines.append(lp_line(measurement, tags, fields, timestamp, integer_fields))
+        if stats is not None:
+            elapsed = time.time() - start
+            stats.count("encode_seconds", elapsed)
+            stats.count("encode_{}_seconds".format(resource), elapsed)
+            stats.count("encode_{}_bytes".format(resource), sum(len(line) + 1 for line in lines if line is not None))
+        for line in lines:
+            if line is not None:
+                yield line
+    if rates is not None:
+        rates.prune()
+    if states is not None:
+        states.prune()
+
+
+def dcs_to_lines(datas, target, rates=None):
+    """
+    Encode DataCore Objects performances in InfluxDB line protocol
+    """
+    return list(dcs_iter_lines(datas, target, rates))
+
+
+def dcs_inventory_to_lines(datas, target):
+    """
+    Encode descriptive attributes of DataCore Objects in the
+    DataCore_Inventory measurement, as fields so they add no series
+    """
+    timestamp = int(time.time()) * 1000000000
+    for data in datas:
+        resource = data["dcs_resource"]
+        if resource not in DCS_INFOS:
+            continue
+        if resource == "virtualdisks" and data["StorageProfileId"] == None:
+            continue
+        objectname = DCS_MEASUREMENTS[resource][1]
+        host, add_tags, add_fields, attributes = DCS_INFOS[resource](data, target)
+        fields = {"Caption": dcs_str(data["Caption"]),
+                  "ExtendedCaption": dcs_str(data["ExtendedCaption"])}
+        fields.update(attributes)
+        line = lp_line("DataCore_Inventory", dcs_base_tags(data, objectname, host, target.group) + add_tags,
+                       fields, timestamp)
+        if line is not None:
+            yield line
+
+
+def put_in_influxdb(writer, target, datas, listed=(), stats=None, snapshot=None):
+
+    # Lines are encoded as datas come and posted batch by batch,
+    # listed is only read once datas are exhausted
+    lines = itertools.chain(dcs_iter_lines(datas, target, target.rates, stats, snapshot),
+                            dcs_inventory_to_lines(listed, target))
+
+    # Post in influxdb, state fields are only recorded as written if
+    # every point was written or spooled
+    logging.info("Post data of {} in influxdb".format(target.name))
+    failed = None
+    try:
+        failed = writer.write(lines, stats)
+    finally:
+        if target.states is not None:
+            target.states.commit(failed == 0)
+    if not failed:
+        logging.info("Done!")
+    else:
+        logging.error("{} points could not be written".format(failed))
+
+
+
+
+def dcs_collect(target, writer, stats=None, intervals=None, tick=None):
+    """
+    Run one collection cycle of a target: inventory, perf and post in influxdb
+
+    Listing, perf queries, encoding and writes overlap (see dcs_iter_perf),
+    so a cycle lasts about as long as its slowest stage. Resources with a
+    longer interval than the collector only have part of their objects
+    polled at each tick (see dcs_polled). Cycles are profiled while the
+    target profiler is armed (see DcsProfiler).
+    """
+    if stats is None:
+        stats = DcsCycleStats(target=target)
+    profile = target.profiler.begin(target) if target.profiler is not None else None
+    try:
+        dcs_collect_cycle(target, writer, stats, intervals, tick)
+    finally:
+        if profile is not None:
+            target.profiler.end(target, profile)
+    return stats
+
+
+def dcs_collect_cycle(target, writer, stats, intervals, tick):
+    """
+    Stages of a collection cycle, see dcs_collect
+    """
+    target.client.take_latencies()
+
+    interval = config.getint('COLLECTOR', 'interval', fallback=10)
+    if intervals is None:
+        intervals = dcs_resource_intervals(interval)
+    if tick is None:
+        tick = int(stats.start // interval)
+    resources = dict((resource, seconds // interval) for resource, seconds in intervals.items())
+    dcs_listed = []
+    dcs_perfs = dcs_iter_perf(target, resources, tick, dcs_listed, stats)
+    snapshot = {} if target.exporter is not None else None
+
+    put_in_influxdb(writer, target, dcs_perfs, dcs_listed, stats, snapshot)
+    stats.latencies(target.client.take_latencies())
+    stats.fields["inflight_limit"] = target.client.concurrency.limit
+    if snapshot is not None:
+        target.exporter.publish(target, snapshot)
+
+
+def dcs_write_stats(writer, stats):
+    """
+    Write the DataCore_Collector point of a cycle, and publish it to the
+    exporter of its target, if any
+    """
+    if stats.target is not None and stats.target.exporter is not None:
+        stats.target.exporter.publish_stats(stats)
+    line = stats.to_line()
+    if line is not None and writer.write([line], merge=True):
+        logging.warning("Collector stats could not be written")
+
+
+def dcs_target_loop(target, writer, interval, intervals, stop):
+    """
+    Run collection cycles of a target on a fixed cadence until stop is set
+
+    Ticks are aligned on multiples of interval and computed from the
+    previous tick, not from the end of the cycle, so they do not drift.
+    A cycle running past its tick never overlaps the next one: the
+    missed ticks are skipped and logged. A slow or failing target only
+    delays its own cycles.
+    """
+    next_tick = (int(time.time() // interval) + 1) * interval
+    while True:
+        delay = next_tick - time.time()
+        if delay > interval:
+            # Wall clock went backward, align again
+            next_tick = (int(time.time() // interval) + 1) * interval
+            delay = next_tick - time.time()
+        if stop.wait(max(delay, 0)):
+            break
+
+        stats = DcsCycleStats(interval, target)
+        stats.fields["late_seconds"] = stats.start - next_tick
+        try:
+            dcs_collect(target, writer, stats, intervals, int(round(next_tick / interval)))
+        except DcsError as e:
+            logging.error("{}: {}".format(target.name, e))
+            stats.count("cycle_errors")
+        except Exception:
+            logging.exception("Collection cycle of {} failed".format(target.name))
+            stats.count("cycle_errors")
+        end = time.time()
+        stats.fields["cycle_seconds"] = end - stats.start
+
+        next_tick += interval
+        skipped = 0
+        if end >= next_tick:
+            skipped = int((end - next_tick) // interval) + 1
+            logging.warning("{}: cycle took {:.1f}s, skipping {} tick(s)".format(
+                target.name, end - stats.start, skipped))
+            next_tick += skipped * interval
+        stats.fields["skipped_ticks"] = skipped
+        dcs_write_stats(writer, stats)
+
+
+def dcs_daemon(interval, intervals, targets, writer=None):
+    """
+    Run collection cycles of every target, each in its own thread, until
+    SIGTERM/SIGINT. Points go to writer, InfluxDB by default.
+    """
+    stop = threading.Event()
+
+    def dcs_stop(signum, frame):
+        logging.info("Signal {} received, stopping".format(signum))
+        stop.set()
+
+    signal.signal(signal.SIGTERM, dcs_stop)
+    signal.signal(signal.SIGINT, dcs_stop)
+
+    logging.info("Daemon started, polling {} every {}s".format(
+        ", ".join(target.name for target in targets), interval))
+    for resource, seconds in sorted(intervals.items()):
+        if seconds != interval:
+            logging.info("{} polled every {}s".format(resource, seconds))
+
+    # Connections and workers are kept warm between cycles
+    if writer is None:
+        writer = influx_writer()
+    for target in targets:
+        target.open(rates=True)
+
+    workers = []
+    if writer.spool is not None:
+        drain = threading.Thread(target=writer.spool.run,
+                                 args=(writer, stop, config.getfloat('SPOOL', 'drain_rate', fallback=2), interval))
+        drain.daemon = True
+        workers.append(drain)
+    for target in targets:
+        worker = threading.Thread(target=dcs_target_loop, args=(target, writer, interval, intervals, stop),
+                                  name="dcs-{}".format(target.name))
+        worker.daemon = True
+        workers.append(worker)
+
+    try:
+        for worker in workers:
+            worker.start()
+        # Signals are only delivered to the main thread, do not block in join
+        while not stop.is_set():
+            stop.wait(1)
+    finally:
+        stop.set()
+        for worker in workers:
+            worker.join(max(interval, writer.timeout))
+        for target in targets:
+            target.close()
+        writer.close()
+
+    logging.info("Daemon stopped")
+
+
+def dcs_collect_targets(targets, writer, intervals, interval=None):
+    """
+    Run one collection cycle of every target in parallel, return the
+    number of targets that failed
+    """
+    failed = []
+
+    def collect(target):
+        stats = DcsCycleStats(interval, target)
+        try:
+            dcs_collect(target, writer, stats, intervals)
+        except DcsError as e:
+            logging.error("{}: {}".format(target.name, e))
+            stats.count("cycle_errors")
+            failed.append(target)
+        except Exception:
+            logging.exception("Collection cycle of {} failed".format(target.name))
+            stats.count("cycle_errors")
+            failed.append(target)
+        stats.fields["cycle_seconds"] = time.time() - stats.start
+        dcs_write_stats(writer, stats)
+
+    workers = [threading.Thread(target=collect, args=(target,)) for target in targets]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return len(failed)
+
+
+def dcs_collect_once(intervals, targets):
+    """
+    Run one collection cycle of every target and drain the spool, return
+    the number of targets that failed
+    """
+    writer = influx_writer()
+    try:
+        for target in targets:
+            target.open()
+        failed = dcs_collect_targets(targets, writer, intervals)
+        if writer.spool is not None:
+            rate = config.getfloat('SPOOL', 'drain_rate', fallback=2)
+            writer.spool.drain(writer, threading.Event(),
+                               rate * config.getint('COLLECTOR', 'interval', fallback=10), rate)
+    finally:
+        for target in targets:
+            target.close()
+        writer.close()
+    return failed
+
+
+def dcs_execd_writer():
+    """
+    Create the stdout line protocol writer of --execd
+    """
+    return LineWriter(getattr(sys.stdout, 'buffer', sys.stdout),
+                      config.getint('INFLUXDB', 'batch_points', fallback=5000))
+
+
+def dcs_execd(interval, intervals, targets):
+    """
+    Run as a telegraf [[inputs.execd]] plugin: one cycle of every target
+    each time telegraf asks, points written to stdout
+
+    Telegraf asks with a line on stdin (signal = "STDIN"), SIGHUP or
+    SIGUSR1. Each target runs its cycles in its own thread and writes its
+    points as soon as they are encoded, so a slow target does not delay
+    the others: requests coming during a cycle of a target trigger a
+    single cycle of that target after it. Stops at the end of stdin, when
+    telegraf exits, or on SIGTERM.
+    """
+    stop = threading.Event()
+    trigger = threading.Event()
+
+    def dcs_stop(signum, frame):
+        logging.info("Signal {} received, stopping".format(signum))
+        stop.set()
+
+    def dcs_trigger(signum, frame):
+        trigger.set()
+
+    signal.signal(signal.SIGTERM, dcs_stop)
+    signal.signal(signal.SIGINT, dcs_stop)
+    signal.signal(signal.SIGHUP, dcs_trigger)
+    signal.signal(signal.SIGUSR1, dcs_trigger)
+
+    def read_stdin():
+        for line in iter(sys.stdin.readline, ''):
+            trigger.set()
+        logging.info("End of stdin, stopping")
+        stop.set()
+
+    reader = threading.Thread(target=read_stdin)
+    reader.daemon = True
+
+    def collect(target, pending):
+        while not stop.is_set():
+            if not pending.wait(1) or stop.is_set():
+                continue
+            pending.clear()
+            dcs_collect_targets([target], writer, intervals, interval)
+
+    logging.info("Execd started for {}".format(", ".join(target.name for target in targets)))
+    writer = dcs_execd_writer()
+    for target in targets:
+        target.open(rates=True)
+    pendings = [threading.Event() for target in targets]
+    workers = [threading.Thread(target=collect, args=(target, pending), name="dcs-{}".format(target.name))
+               for target, pending in zip(targets, pendings)]
+    try:
+        reader.start()
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        while not stop.is_set():
+            # Signals are only delivered to the main thread, do not block
+            if not trigger.wait(1) or stop.is_set():
+                continue
+            trigger.clear()
+            for pending in pendings:
+                pending.set()
+    finally:
+        stop.set()
+        for worker in workers:
+            worker.join(interval)
+        for target in targets:
+            target.close()
+        writer.close()
+
+    logging.info("Execd stopped")
+
+
+def dcs_shard_arg(value):
+    """
+    Parse a --shard I/N argument
+    """
+    try:
+        shard, shards = [int(part) for part in value.split("/")]
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected I/N, got {}".format(value))
+    if shards < 1 or not 0 <= shard < shards:
+        raise argparse.ArgumentTypeError("shard must be in 0..N-1, got {}".format(value))
+    return shard, shards
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Collect DataCore REST performances into InfluxDB")
+    parser.add_argument("-c", "--config", default="/etc/datacore/datacore_get_perf.ini",
+                        help="config file (default: %(default)s)")
+    parser.add_argument("-d", "--daemon", action="store_true",
+                        help="run as a long-running collector instead of a single cycle")
+    parser.add_argument("--execd", action="store_true",
+                        help="write line protocol to stdout for telegraf [[inputs.execd]], one cycle per "
+                             "line on stdin, SIGHUP or SIGUSR1 (with --daemon: every interval)")
+    parser.add_argument("--exporter", action="store_true",
+                        help="run as a Prometheus exporter only, serving /metrics without writing to InfluxDB")
+    parser.add_argument("--shard", type=dcs_shard_arg, metavar="I/N",
+                        help="only collect the targets of shard I out of N (default: [COLLECTOR] shard/shards)")
+    args = parser.parse_args()
+
+    load_config(args.config)
+    targets = dcs_targets(*(args.shard or ()))
+    if not targets:
+        logging.warning("No target to collect")
+        sys.exit(0)
+
+    interval = config.getint('COLLECTOR', 'interval', fallback=10)
+    try:
+        intervals = dcs_resource_intervals(interval)
+    except DcsError as e:
+        logging.error(e)
+        sys.exit(1)
+
+    vsphere = dcs_vsphere()
+    profiler = dcs_profiler()
+    for target in targets:
+        target.vsphere = vsphere
+        target.profiler = profiler
+    if hasattr(signal, 'SIGUSR2'):
+        signal.signal(signal.SIGUSR2, lambda signum, frame: profiler.arm())
+
+    if not (args.daemon or args.execd or args.exporter):
+        sys.exit(1 if dcs_collect_once(intervals, targets) else 0)
+
+    exporter = dcs_exporter(intervals, args.exporter)
+    for target in targets:
+        target.exporter = exporter
+    try:
+        if args.exporter:
+            dcs_daemon(interval, intervals, targets,
+                       LineWriter(open(os.devnull, 'wb'), config.getint('INFLUXDB', 'batch_points', fallback=5000)))
+        elif args.execd and args.daemon:
+            dcs_daemon(interval, intervals, targets, dcs_execd_writer())
+        elif args.execd:
+            dcs_execd(interval, intervals, targets)
+        else:
+            dcs_daemon(interval, intervals, targets)
+    finally:
+        if exporter is not None:
+            exporter.close()
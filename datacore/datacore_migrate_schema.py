@@ -0,0 +1,134 @@
+#coding:utf-8
+"""
+Migrate DataCoreRestDB to the schema v2 of datacore_get_perf.py
+
+Schema v1 tagged every perf point with descriptive attributes (Caption,
+OsVersion, ScsiDeviceIdString, FirstHost...). Schema v2 only keeps the
+identity and type tags, attributes are in DataCore_Inventory. The v1
+points are copied into v2 series, chunk by chunk and for every retention
+policy, then the v1 series are dropped.
+"""
+from __future__ import print_function, unicode_literals
+import argparse
+import sys
+import time
+
+import requests
+
+import datacore_get_perf as dcs
+
+# Tags of schema v2 perf series
+SCHEMA_V2_TAGS = ["instance", "objectname", "host", "id", "group", "Type", "PortRole"]
+
+
+def influx_query(session, url, query, dry_run=False):
+    """
+    Run an InfluxQL query on DataCoreRestDB, return its first result
+    """
+    if dry_run and not query.startswith(("SHOW", "SELECT *")):
+        print(query)
+        return {}
+    r = session.post(url, params={"db": "DataCoreRestDB", "epoch": "ns"}, data={"q": query})
+    r.raise_for_status()
+    result = r.json()["results"][0]
+    if "error" in result:
+        raise dcs.DcsError("{}: {}".format(query, result["error"]))
+    return result
+
+
+def influx_values(result):
+    """
+    Rows of all series of a query result
+    """
+    rows = []
+    for serie in result.get("series", []):
+        rows += serie["values"]
+    return rows
+
+
+def migrate_measurement(session, url, measurement, policies, chunk, dry_run):
+    """
+    Copy the v1 series of a measurement into v2 series, return the v1 filter
+    """
+    tag_keys = [row[0] for row in influx_values(influx_query(
+        session, url, 'SHOW TAG KEYS FROM "{}"'.format(measurement)))]
+    v1_tags = [key for key in tag_keys if key not in SCHEMA_V2_TAGS]
+    if not v1_tags:
+        print("{}: already in schema v2".format(measurement))
+        return None
+    v1_filter = " OR ".join('"{}" =~ /./'.format(key) for key in v1_tags)
+    group_by = ", ".join('"{}"'.format(key) for key in SCHEMA_V2_TAGS if key in tag_keys)
+
+    for policy in policies:
+        source = '"DataCoreRestDB"."{}"."{}"'.format(policy, measurement)
+        fields = [row[0] for row in influx_values(influx_query(
+            session, url, 'SHOW FIELD KEYS FROM {}'.format(source)))]
+        if not fields:
+            continue
+        bounds = []
+        for order in ("ASC", "DESC"):
+            rows = influx_values(influx_query(session, url, 'SELECT * FROM {} WHERE {} ORDER BY time {} LIMIT 1'.format(
+                source, v1_filter, order)))
+            if rows:
+                bounds.append(rows[0][0])
+        if not bounds:
+            continue
+
+        select = ", ".join('"{}"::field'.format(field) for field in fields)
+        first, last = bounds
+        written = 0
+        start = first - first % chunk
+        while start <= last:
+            result = influx_query(session, url,
+                                  'SELECT {} INTO {} FROM {} WHERE ({}) AND time >= {} AND time < {} GROUP BY {}'.format(
+                                      select, source, source, v1_filter, start, start + chunk, group_by), dry_run)
+            for row in influx_values(result):
+                written += row[1]
+            start += chunk
+        print("{}.{}: {} points copied".format(policy, measurement, written))
+    return v1_filter
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Migrate DataCoreRestDB series to schema v2")
+    parser.add_argument("-c", "--config", default="/etc/datacore/datacore_get_perf.ini",
+                        help="config file (default: %(default)s)")
+    parser.add_argument("--chunk-hours", type=int, default=24,
+                        help="hours of points copied per query (default: %(default)s)")
+    parser.add_argument("--keep-v1", action="store_true",
+                        help="copy only, do not drop the v1 series")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="print the statements instead of running them")
+    args = parser.parse_args()
+
+    dcs.load_config(args.config)
+    url = "http://{}:{}/query".format(dcs.config['SERVERS']['influxdb_server'],
+                                      dcs.config['SERVERS']['influxdb_port'])
+    chunk = args.chunk_hours * 3600 * 1000000000
+
+    session = requests.Session()
+    try:
+        policies = [row[0] for row in influx_values(influx_query(
+            session, url, 'SHOW RETENTION POLICIES ON "DataCoreRestDB"')) if row[0] != "forever"]
+
+        start = time.time()
+        v1_filters = []
+        for measurement, objectname in sorted(dcs.DCS_MEASUREMENTS.values()):
+            v1_filter = migrate_measurement(session, url, measurement, policies, chunk, args.dry_run)
+            if v1_filter is not None:
+                v1_filters.append((measurement, v1_filter))
+
+        # Series are dropped once every policy is copied
+        if not args.keep_v1:
+            for measurement, v1_filter in v1_filters:
+                influx_query(session, url, 'DROP SERIES FROM "{}" WHERE {}'.format(measurement, v1_filter),
+                             args.dry_run)
+                if not args.dry_run:
+                    print("{}: v1 series dropped".format(measurement))
+        print("Migrated in {:.1f}s".format(time.time() - start))
+    except (requests.exceptions.RequestException, dcs.DcsError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    finally:
+        session.close()
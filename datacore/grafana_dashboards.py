@@ -0,0 +1,125 @@
+#coding:utf-8
+"""
+Provision Grafana dashboards from their JSON definitions
+
+Each dashboard is compared with the one Grafana has under the same uid,
+by a hash of its content without the id and version Grafana sets on
+save. Only missing or changed dashboards are uploaded, in parallel over
+one session, once Grafana answers its health check.
+"""
+from __future__ import print_function, unicode_literals
+import argparse
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# Set by Grafana on save, not part of a dashboard definition
+GRAFANA_KEYS = ("id", "version")
+
+
+class GrafanaError(Exception):
+    pass
+
+
+def dashboard_hash(dashboard):
+    """
+    Hash of a dashboard content, stable across Grafana saves
+    """
+    content = dict((k, v) for k, v in dashboard.items() if k not in GRAFANA_KEYS)
+    return hashlib.sha1(json.dumps(content, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+def wait_ready(session, url, timeout):
+    """
+    Wait until Grafana and its database answer, at most timeout seconds
+    """
+    deadline = time.time() + timeout
+    while True:
+        try:
+            r = session.get(url + "/api/health", timeout=5)
+            if r.status_code == 200 and r.json().get("database") == "ok":
+                return
+        except (requests.exceptions.RequestException, ValueError):
+            pass
+        if time.time() >= deadline:
+            raise GrafanaError("Grafana at {} not ready after {}s".format(url, timeout))
+        time.sleep(1)
+
+
+def provision(session, url, path):
+    """
+    Upload a dashboard file unless Grafana has the same content, return
+    the dashboard id and whether it was uploaded
+    """
+    with io.open(path, encoding="utf-8") as f:
+        dashboard = json.load(f)
+    uid = dashboard.get("uid")
+    if not uid:
+        raise GrafanaError("{}: dashboard has no uid".format(path))
+
+    r = session.get("{}/api/dashboards/uid/{}".format(url, uid))
+    if r.status_code == 200:
+        current = r.json()["dashboard"]
+        if dashboard_hash(current) == dashboard_hash(dashboard):
+            return current["id"], False
+    elif r.status_code != 404:
+        r.raise_for_status()
+
+    payload = {"dashboard": dict(dashboard, id=None),
+               "folderId": 0,
+               "overwrite": True,
+               "message": "Provisioned from {}".format(os.path.basename(path))}
+    r = session.post(url + "/api/dashboards/db", json=payload)
+    if r.status_code != 200:
+        raise GrafanaError("{}: upload failed ({}): {}".format(path, r.status_code, r.text))
+    return r.json()["id"], True
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Upload changed dashboards to Grafana")
+    parser.add_argument("dashboards", nargs="+", help="dashboard JSON files")
+    parser.add_argument("--url", default="http://127.0.0.1:3000",
+                        help="Grafana URL (default: %(default)s)")
+    parser.add_argument("--user", default="grafana", help="Grafana user (default: %(default)s)")
+    parser.add_argument("--password", default="grafana", help="Grafana password")
+    parser.add_argument("--home", help="dashboard file set as home dashboard of the user")
+    parser.add_argument("--timeout", type=int, default=120,
+                        help="seconds to wait for Grafana (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="parallel uploads (default: %(default)s)")
+    args = parser.parse_args()
+
+    url = args.url.rstrip("/")
+    session = requests.Session()
+    session.auth = (args.user, args.password)
+    session.headers.update({"Accept": "application/json"})
+    try:
+        start = time.time()
+        wait_ready(session, url, args.timeout)
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            results = list(executor.map(lambda path: provision(session, url, path), args.dashboards))
+        ids = {}
+        for path, (dashboard_id, uploaded) in zip(args.dashboards, results):
+            ids[os.path.abspath(path)] = dashboard_id
+            print("{}: {}".format(path, "uploaded" if uploaded else "unchanged"))
+
+        if args.home:
+            home = ids.get(os.path.abspath(args.home))
+            if home is None:
+                raise GrafanaError("{}: home dashboard is not provisioned".format(args.home))
+            r = session.put(url + "/api/user/preferences",
+                            json={"theme": "", "homeDashboardId": home, "timezone": ""})
+            r.raise_for_status()
+        print("Provisioned in {:.1f}s".format(time.time() - start))
+    except (requests.exceptions.RequestException, GrafanaError, IOError, ValueError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    finally:
+        session.close()
@@ -0,0 +1,260 @@
+#coding:utf-8
+"""
+Caching proxy of the InfluxDB /query endpoint for Grafana
+
+Dashboards refreshed by many viewers send the same template and panel
+queries again and again. Read queries (SELECT and SHOW only) are
+answered from a cache: absolute time bounds are aligned to the collector
+interval so viewers share results, SELECT results are kept one interval
+and SHOW results show_ttl seconds. Identical queries arriving while one
+is in flight wait for its response instead of reaching InfluxDB. Other
+requests are passed through. Counters are served on /metrics.
+"""
+from __future__ import print_function, unicode_literals
+import argparse
+import collections
+import json
+import logging
+import re
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qsl, urlsplit
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qsl, urlsplit
+
+import requests
+
+import datacore_get_perf as dcs
+
+# Absolute time bounds as sent by Grafana: time >= 1584031831349ms
+TIME_BOUND = re.compile(r'(\btime\s*[<>]=?\s*)(\d+)ms\b', re.I)
+INTO_CLAUSE = re.compile(r'\bINTO\b', re.I)
+
+# Request headers forwarded to InfluxDB, Authorization is part of the cache key
+FORWARDED_HEADERS = ("Authorization", "Content-Type", "Accept")
+
+
+def cache_policy(query, interval, show_ttl):
+    """
+    Aligned query and TTL of a read-only query, None if it must reach
+    InfluxDB as is
+    """
+    statements = [statement.strip() for statement in query.split(";") if statement.strip()]
+    if not statements:
+        return None
+    verbs = set(statement.split(None, 1)[0].upper() for statement in statements)
+    if not verbs <= set(["SELECT", "SHOW"]) or INTO_CLAUSE.search(query):
+        return None
+    step = int(interval * 1000)
+    aligned = TIME_BOUND.sub(lambda m: "{}{}ms".format(m.group(1), int(m.group(2)) // step * step), query)
+    return aligned, (show_ttl if verbs == set(["SHOW"]) else interval)
+
+
+class CachedResponse(object):
+    """
+    Status, content type and body of an InfluxDB response, gzip
+    compressed once on the first request accepting it
+    """
+
+    def __init__(self, status, content_type, body):
+        self.status = status
+        self.content_type = content_type
+        self.body = body
+        self.compressed = None
+
+    def gzipped(self):
+        if self.compressed is None:
+            self.compressed = dcs.gzip_compress(self.body)
+        return self.compressed
+
+
+class QueryCache(object):
+    """
+    Responses of read queries by request key, each with its own TTL
+
+    Only 200 responses are cached, least recently used first out beyond
+    max_entries. Requests for a key being fetched wait for that fetch and
+    share its response, cached or not.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.pending = {}
+        self.stats = dict((name, 0) for name in ("hits", "misses", "coalesced", "bypassed",
+                                                 "errors", "evictions"))
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.stats[name] += value
+
+    def get(self, key, ttl, fetch):
+        """
+        Response of key and how it was answered (HIT, MISS or COALESCED),
+        fetch() returns it on a miss
+        """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None and entry[0] > time.time():
+                self.entries[key] = entry
+                self.stats["hits"] += 1
+                return entry[1], "HIT"
+            waiter = self.pending.get(key)
+            leader = waiter is None
+            if leader:
+                waiter = self.pending[key] = [threading.Event(), None]
+                self.stats["misses"] += 1
+            else:
+                self.stats["coalesced"] += 1
+        if not leader:
+            waiter[0].wait()
+            return waiter[1], "COALESCED"
+
+        response = None
+        try:
+            response = fetch()
+        finally:
+            with self.lock:
+                waiter[1] = response
+                del self.pending[key]
+                if response is not None and response.status == 200:
+                    self.entries[key] = (time.time() + ttl, response)
+                    while len(self.entries) > self.max_entries:
+                        self.entries.popitem(last=False)
+                        self.stats["evictions"] += 1
+            waiter[0].set()
+        return response, "MISS"
+
+    def metrics(self):
+        """
+        Prometheus exposition of the cache counters
+        """
+        with self.lock:
+            stats = dict(self.stats)
+            entries = list(self.entries.values())
+        lines = []
+        for name in sorted(stats):
+            metric = "datacore_query_cache_{}_total".format(name)
+            lines += ["# TYPE {} counter".format(metric), "{} {}".format(metric, stats[name])]
+        lines += ["# TYPE datacore_query_cache_entries gauge",
+                  "datacore_query_cache_entries {}".format(len(entries)),
+                  "# TYPE datacore_query_cache_bytes gauge",
+                  "datacore_query_cache_bytes {}".format(sum(len(entry[1].body) for entry in entries))]
+        return "\n".join(lines) + "\n"
+
+
+class QueryCacheHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, response, cache_status=None):
+        body = response.body
+        gzipped = len(body) > 1024 and "gzip" in (self.headers.get("Accept-Encoding") or "")
+        if gzipped:
+            body = response.gzipped()
+        self.send_response(response.status)
+        self.send_header("Content-Type", response.content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if gzipped:
+            self.send_header("Content-Encoding", "gzip")
+        if cache_status is not None:
+            self.send_header("X-Cache", cache_status)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def forward(self, method, path, params, data):
+        """
+        Send a request to InfluxDB, 502 if it can not be reached
+        """
+        server = self.server
+        headers = dict((name, self.headers.get(name)) for name in FORWARDED_HEADERS if self.headers.get(name))
+        try:
+            r = server.session.request(method, server.upstream + path, params=params, data=data,
+                                       headers=headers, timeout=server.timeout)
+            return CachedResponse(r.status_code, r.headers.get("Content-Type", "application/json"), r.content)
+        except requests.exceptions.RequestException as e:
+            server.cache.count("errors")
+            logging.error("InfluxDB query failed: {}".format(e))
+            return CachedResponse(502, "application/json", json.dumps({"error": str(e)}).encode("utf-8"))
+
+    def proxy(self):
+        server = self.server
+        url = urlsplit(self.path)
+        data = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if url.path == "/metrics" and self.command == "GET":
+            return self.send(CachedResponse(200, "text/plain; version=0.0.4; charset=utf-8",
+                                            server.cache.metrics().encode("utf-8")))
+        if url.path != "/query":
+            return self.send(self.forward(self.command, url.path, url.query, data or None))
+
+        params = parse_qsl(url.query, keep_blank_values=True)
+        if self.command == "POST" and "form-urlencoded" in (self.headers.get("Content-Type") or ""):
+            params += parse_qsl(data.decode("utf-8"), keep_blank_values=True)
+        query = "".join(value for name, value in params if name == "q")
+        policy = cache_policy(query, server.interval, server.show_ttl)
+        if policy is None:
+            server.cache.count("bypassed")
+            return self.send(self.forward(self.command, url.path, url.query, data or None))
+
+        aligned, ttl = policy
+        params = sorted((name, value) for name, value in params if name != "q") + [("q", aligned)]
+        key = (tuple(params), self.headers.get("Authorization"))
+        response, cache_status = server.cache.get(key, ttl,
+                                                  lambda: self.forward("POST", url.path, None, params))
+        if response is None:
+            response = CachedResponse(502, "application/json", b'{"error":"query failed"}')
+        self.send(response, cache_status)
+
+    do_GET = proxy
+    do_POST = proxy
+
+
+class QueryCacheServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, upstream, interval, show_ttl, max_entries, timeout):
+        HTTPServer.__init__(self, address, QueryCacheHandler)
+        self.upstream = upstream
+        self.interval = interval
+        self.show_ttl = show_ttl
+        self.timeout = timeout
+        self.cache = QueryCache(max_entries)
+        self.session = requests.Session()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Caching proxy of InfluxDB /query for Grafana")
+    parser.add_argument("-c", "--config", default="/etc/datacore/datacore_get_perf.ini",
+                        help="config file (default: %(default)s)")
+    args = parser.parse_args()
+
+    dcs.load_config(args.config)
+    config = dcs.config
+    host, port = config.get('CACHE', 'listen', fallback='127.0.0.1:8087').rsplit(':', 1)
+    upstream = "http://{}:{}".format(config['SERVERS']['influxdb_server'], config['SERVERS']['influxdb_port'])
+    server = QueryCacheServer((host, int(port)), upstream,
+                              config.getint('COLLECTOR', 'interval', fallback=10),
+                              config.getfloat('CACHE', 'show_ttl', fallback=60),
+                              config.getint('CACHE', 'max_entries', fallback=10000),
+                              config.getfloat('INFLUXDB', 'timeout', fallback=10))
+    logging.info("Caching InfluxDB {} queries on {}:{}".format(upstream, host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.session.close()